@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+'''
+benchmarks of morphling, run with ``python -m benchmarks``
+'''
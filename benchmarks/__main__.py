@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import getopt
+
+from benchmarks import suite
+
+
+def print_usage():
+    print('''Usage: python -m benchmarks [OPTIONS...]
+Time parsing and rendering of generated markdown documents, and reading them
+from files.
+Options:
+  -s/--size=CHARS                size of each generated document, default 200000
+  -r/--repeat=N                  timed runs per case, the best is kept, default 3
+  -c/--cases=NAME,...            only run these cases
+  -o/--output=FILE               write the results as json
+  -b/--baseline=FILE             compare with the json results of an earlier run
+  -t/--threshold=FRACTION        allowed growth over the baseline, default 0.1
+''')
+
+
+def print_case(name, case):
+    print('{name:<12} {size:>9} chars  parse {parse:8.4f}s {pmbs:7.2f} MB/s  '
+          'render {render:8.4f}s {rmbs:7.2f} MB/s  peak {peak:8.2f} MB'.format(
+              name=name, size=case['size'],
+              parse=case['parse_seconds'], pmbs=case['parse_mb_per_second'],
+              render=case['render_seconds'], rmbs=case['render_mb_per_second'],
+              peak=case['peak_memory'] / 1e6))
+
+
+def print_reading(name, case):
+    print('{name:<14} {size:>9} chars  whole {read:8.4f}s peak {rpeak:8.2f} MB  '
+          'reader {reader:8.4f}s peak {rdpeak:8.2f} MB  {change:+.0f}%'.format(
+              name=name, size=case['size'],
+              read=case['read_seconds'], rpeak=case['read_peak_memory'] / 1e6,
+              reader=case['reader_seconds'], rdpeak=case['reader_peak_memory'] / 1e6,
+              change=(case['reader_peak_memory'] / float(case['read_peak_memory']) - 1) * 100))
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:], 'hs:r:c:o:b:t:',
+            ['help', 'size=', 'repeat=', 'cases=', 'output=', 'baseline=', 'threshold='])
+    except getopt.GetoptError as e:
+        print(str(e))
+        sys.exit(2)
+    size, repeat, names = 200000, 3, None
+    output_path = baseline_path = None
+    threshold = 0.1
+    try:
+        for o, a in opts:
+            if o in ('-h', '--help'):
+                print_usage()
+                sys.exit(2)
+            if o in ('-s', '--size'):
+                size = int(a)
+            if o in ('-r', '--repeat'):
+                repeat = int(a)
+            if o in ('-c', '--cases'):
+                names = a.split(',')
+            if o in ('-o', '--output'):
+                output_path = a
+            if o in ('-b', '--baseline'):
+                baseline_path = a
+            if o in ('-t', '--threshold'):
+                threshold = float(a)
+    except ValueError as e:
+        print(str(e))
+        sys.exit(2)
+
+    results = suite.run(size=size, repeat=repeat, names=names, report=print_case,
+                        report_reading=print_reading)
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline_path:
+        with open(baseline_path, 'r') as f:
+            baseline = json.load(f)
+        regressions = suite.compare(baseline, results, threshold)
+        for regression in regressions:
+            print('regression: %s' % regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+'''
+inputs crafted to make the regexes backtrack, timed at two sizes: the time to
+render them stays linear in their size, see tests/test_adversarial.py. run with
+``python -m benchmarks.adversarial [case...]``.
+'''
+import sys
+import time
+from collections import OrderedDict
+
+from morphling.parser import MarkdownParser
+
+
+# name -> function building a document out of n repetitions of a pattern
+cases = OrderedDict([
+    ('unclosed fences', lambda n: 'text\n```\n' * n),
+    ('fence info', lambda n: '```x\n' * n),
+    ('quote fence', lambda n: '> ```x\n' * n),
+    ('list items fence', lambda n: '- ```x\n' * n),
+    ('paragraph lines', lambda n: 'word word word\n' * n),
+    ('bullets in paragraph', lambda n: 'a\n- b\n' * n),
+    ('setext', lambda n: 'a\n' * n),
+    ('lazy list', lambda n: '- a\n  b\n' * n),
+    ('list then text', lambda n: '- a\n' + 'b\n' * n),
+    ('rule-like items', lambda n: '- - x\n' * n),
+    ('link definitions', lambda n: '[a]: b\n' * n),
+    ('unclosed emphasis', lambda n: 'a _b ' * n),
+    ('unclosed strong', lambda n: '**a ' * n),
+    ('brackets', lambda n: '[a ' * n),
+    ('unclosed links', lambda n: '![a](' * n),
+    ('unclosed strikethrough', lambda n: '~~a ' * n),
+    ('unclosed inline tags', lambda n: '<span>a ' * n),
+    ('unclosed comments', lambda n: '<!-- a\n\n' * n),
+    ('unclosed reference links', lambda n: '[a] [b' * n),
+])
+
+
+def best_time(text, repeat):
+    '''
+    return the best seconds of ``repeat`` renders of the text
+    '''
+    parser = MarkdownParser()
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        parser.render(text)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(n=2000, repeat=3, names=None, report=None):
+    '''
+    time each case with n and with 4n repetitions
+        :params report: called with (name, seconds for n, seconds for 4n)
+    '''
+    for name, build in cases.items():
+        if names and name not in names:
+            continue
+        small = best_time(build(n), repeat)
+        large = best_time(build(4 * n), repeat)
+        if report is not None:
+            report(name, small, large)
+
+
+def main():
+    def report(name, small, large):
+        print('{name:<24} {small:8.4f}s {large:8.4f}s  x{ratio:.1f}'.format(
+            name=name, small=small, large=large, ratio=large / max(small, 1e-9)))
+
+    run(names=sys.argv[1:], report=report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+'''
+deterministic generator of markdown documents for the benchmarks.
+the same (features, size, seed) always gives the same document.
+'''
+import random
+
+
+_words = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+    'incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud '
+    'exercitation ullamco laboris nisi aliquip ex ea commodo consequat duis aute irure'
+).split()
+
+
+class CorpusGenerator(object):
+    '''
+    generate markdown made of blocks of the given features
+        :params seed: seed of the random generator
+    '''
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+
+    def words(self, count):
+        return ' '.join(self.random.choice(_words) for _ in range(count))
+
+    def sentence(self):
+        return self.words(self.random.randint(6, 16)).capitalize() + '.'
+
+    def inline(self):
+        '''
+        a line of prose with a little inline markup
+        '''
+        parts = []
+        for _ in range(self.random.randint(2, 5)):
+            parts.append(self.sentence())
+            roll = self.random.random()
+            if roll < 0.2:
+                parts.append('*%s*' % self.words(2))
+            elif roll < 0.3:
+                parts.append('**%s**' % self.words(2))
+            elif roll < 0.4:
+                parts.append('`%s`' % self.words(1))
+            elif roll < 0.45:
+                parts.append('[%s](http://example.com/%s)' % (self.words(2), self.words(1)))
+        return ' '.join(parts)
+
+    def prose(self):
+        return '\n'.join(self.inline() for _ in range(self.random.randint(1, 4)))
+
+    def lists(self, depth=0):
+        indent = '    ' * depth
+        ordered = self.random.random() < 0.3
+        lines = []
+        for index in range(self.random.randint(2, 5)):
+            bullet = '%d.' % (index + 1) if ordered else '-'
+            lines.append('%s%s %s' % (indent, bullet, self.inline()))
+            if depth < 2 and self.random.random() < 0.3:
+                lines.append(self.lists(depth + 1))
+        return '\n'.join(lines)
+
+    def tables(self):
+        return self.table(None, self.random.randint(2, 5))
+
+    def table(self, rows, columns, pipes=True):
+        '''
+        a table of ``rows`` rows, picked at random when None, without the leading and
+        trailing pipes of each line when ``pipes`` is False
+        '''
+        row_format = '| %s |' if pipes else '%s'
+        lines = [
+            row_format % ' | '.join(self.words(1) for _ in range(columns)),
+            ('|%s|' if pipes else '%s') % '|'.join(
+                self.random.choice([':--', ':-:', '--:', '---']) for _ in range(columns)),
+        ]
+        if rows is None:
+            rows = self.random.randint(3, 12)
+        for _ in range(rows):
+            lines.append(row_format % ' | '.join(self.words(2) for _ in range(columns)))
+        return '\n'.join(lines)
+
+    def fences(self):
+        body = '\n'.join(
+            '    ' * self.random.randint(0, 2) + 'x = f(%s) < 3 & y' % self.words(1)
+            for _ in range(self.random.randint(2, 10)))
+        return '```%s\n%s\n```' % (self.random.choice(['', 'python', 'js']), body)
+
+    def quotes(self):
+        lines = []
+        for _ in range(self.random.randint(1, 4)):
+            lines.append('> ' + self.inline())
+            if self.random.random() < 0.2:
+                lines.append('>> ' + self.inline())
+        return '\n'.join(lines)
+
+    def reflinks(self):
+        key = 'ref %d' % self.random.randint(0, 50)
+        return '%s [%s][%s] %s\n\n[%s]: http://example.com/%s' % (
+            self.sentence(), self.words(2), key, self.sentence(), key, self.words(1))
+
+    def footnotes(self):
+        key = 'n%d' % self.random.randint(0, 50)
+        return '%s[^%s] %s\n\n[^%s]: %s' % (
+            self.sentence(), key, self.sentence(), key, self.inline())
+
+    def document(self, features, size):
+        '''
+        return a document of at least ``size`` characters, made of blocks of
+        ``features`` picked at random
+        '''
+        blocks = []
+        length = 0
+        while length < size:
+            block = getattr(self, self.random.choice(features))()
+            blocks.append(block)
+            length += len(block) + 2
+        return '\n\n'.join(blocks) + '\n'
+
+
+features = ['prose', 'lists', 'tables', 'fences', 'quotes', 'reflinks', 'footnotes']
+
+# pieces of documents with definitions and footnotes before and after their
+# references, fences and blocks left open, and what ``Scanner.prepare`` replaces,
+# for documents cut at random places, see ``generate_pieces``
+pieces = [
+    'word ', 'text', '\n', '\n\n', '- ', '1. ', '> ', '# ', '    ', '`', '*', '_', '---',
+    '\n\n```\n', '\n\n~~~\n', '\n\n[a]: http://a\n', '[r][a]', '\n\n[^n]: x\n', '[^n]',
+    '\n\n[b\n\n', ']: http://b\n', '[r][b]', '|a|b|\n|-|-|\n|c|d|\n', '\r\n', '\t', '\x00',
+]
+
+
+def generate(features, size, seed=0):
+    '''
+    return a markdown document of about ``size`` characters
+        :params features: names of the block kinds to use, see ``features``
+    '''
+    return CorpusGenerator(seed).document(list(features), size)
+
+
+def generate_pieces(generator):
+    '''
+    return a document of 100 to 2000 ``pieces`` picked at random
+        :params generator: a random.Random
+    '''
+    return ''.join(generator.choice(pieces) for _ in range(generator.randint(100, 2000)))
+
+
+def generate_table(rows, columns=4, pipes=True, seed=0):
+    '''
+    return a markdown document of a single table of ``rows`` rows, a Table or, without
+    ``pipes``, an NpTable
+    '''
+    return CorpusGenerator(seed).table(rows, columns, pipes) + '\n'
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+'''
+time ``Renderer.escape`` against the plain implementation it replaced, which
+tests/test_escaping.py checks it against. run with ``python -m benchmarks.escaping``.
+'''
+import re
+import timeit
+
+from morphling.renderer import Renderer
+
+
+_escape_pattern = re.compile(r'&(?!#?\w+;)')
+
+# (name, string) timed by ``run``
+samples = [
+    ('plain', 'plain words without anything to escape ' * 4),
+    ('html', 'a <b>bold</b> & <i>italic</i> "quoted" text ' * 4),
+    ('entities', 'caf&eacute; &amp; th&eacute; &#39;x&#39; ' * 4),
+]
+
+
+def reference_escape(content, quote=False, smart_amp=True):
+    '''
+    the implementation ``Renderer.escape`` must match
+    '''
+    if smart_amp:
+        content = _escape_pattern.sub('&amp;', content)
+    else:
+        content = content.replace('&', '&amp;')
+    content = content.replace('<', '&lt;').replace('>', '&gt;')
+    if quote:
+        content = content.replace('"', '&quot;').replace("'", '&#39;')
+    return content
+
+
+def run(number=20000, report=None):
+    '''
+    time ``Renderer.escape`` and ``reference_escape`` on each of ``samples``
+        :params report: called with (sample name, seconds, reference seconds)
+    '''
+    escape = Renderer().escape
+    for name, content in samples:
+        seconds = timeit.timeit(lambda: escape(content), number=number)
+        reference = timeit.timeit(lambda: reference_escape(content), number=number)
+        if report is not None:
+            report(name, seconds, reference)
+
+
+def main():
+    def report(name, seconds, reference):
+        print('{name:<10} {seconds:8.4f}s  reference {reference:8.4f}s'.format(
+            name=name, seconds=seconds, reference=reference))
+
+    run(report=report)
+
+
+if __name__ == '__main__':
+    main()
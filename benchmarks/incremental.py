@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+'''
+time ``MarkdownParser.reparse`` against rendering the whole document again, on
+edits like those of someone typing in a live preview, see
+tests/test_incremental.py for the check that both give the same html. run with
+``python -m benchmarks.incremental``.
+'''
+import random
+import time
+
+from morphling.parser import MarkdownParser
+
+from benchmarks.corpus import features, generate
+
+
+# what is typed at the edits, mostly letters
+_typed = 'abcdefghijklmnopqrstuvwxyz' * 3 + ' \n*-#='
+
+
+def edits(content, count, seed=0):
+    '''
+    yield ``count`` (offset, deleted, inserted) edits applied one after the other
+    to the content: single characters typed or deleted at random places
+    '''
+    generator = random.Random(seed)
+    length = len(content)
+    for _ in range(count):
+        offset = generator.randint(0, length)
+        if length > offset and generator.random() < 0.3:
+            yield offset, 1, ''
+            length -= 1
+        else:
+            yield offset, 0, generator.choice(_typed)
+            length += 1
+
+
+def run(size, count=200, seed=0):
+    '''
+    return the seconds of a full render of a document of ``size`` characters, and
+    the mean seconds of an edit with ``reparse``, html included
+    '''
+    parser = MarkdownParser()
+    content = generate(features, size, seed)
+    start = time.time()
+    parser.render(content)
+    full = time.time() - start
+    document = parser.parse_document(content)
+    start = time.time()
+    for offset, deleted, inserted in edits(content, count, seed):
+        parser.reparse(document, offset, deleted, inserted)
+        document.html
+    return full, (time.time() - start) / count
+
+
+def main():
+    for size in (10000, 100000, 1000000):
+        full, edit = run(size)
+        print('{size:>8} chars  full {full:8.4f}s  edit {edit:8.4f}s  x{ratio:.0f}'.format(
+            size=size, full=full, edit=edit, ratio=full / edit))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+'''
+time parsing a large document over a pool of processes against parsing it in
+one, see tests/test_parallel.py for the check that both give the same html. run
+with ``python -m benchmarks.parallel``.
+'''
+import time
+from multiprocessing import cpu_count
+
+from morphling.parser import MarkdownParser
+
+from benchmarks.corpus import features, generate
+
+
+def run(size, workers, repeat=2):
+    '''
+    return the best seconds of a serial parse of a document of ``size`` characters
+    and of a parse over ``workers`` processes
+    '''
+    content = generate(features, size)
+    times = []
+    for parser in (MarkdownParser(), MarkdownParser(workers=workers)):
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            parser.parse(content)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best)
+    return times
+
+
+def main():
+    for workers in sorted(set((2, 4, cpu_count()))):
+        serial, pooled = run(10000000, workers)
+        print('{workers:>3} workers  serial {serial:8.4f}s  parallel {pooled:8.4f}s  '
+              'x{ratio:.2f}'.format(workers=workers, serial=serial, pooled=pooled,
+                                    ratio=serial / pooled))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+'''
+time parsing with and without the source positions of ``positions=True``, see
+tests/test_positions.py for their check. run with ``python -m benchmarks.positions``.
+'''
+import time
+
+from morphling.parser import MarkdownParser
+
+from benchmarks.corpus import features, generate
+
+
+def run(size=500000, repeat=5):
+    '''
+    return the best seconds of a parse of a document of ``size`` characters
+    without and with positions
+    '''
+    content = generate(features, size)
+    times = []
+    for positions in (False, True):
+        parser = MarkdownParser(positions=positions)
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            parser.parse(content)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best)
+    return times
+
+
+def main():
+    off, on = run()
+    print('parse  without positions {off:8.4f}s  with {on:8.4f}s  +{extra:.0f}%'.format(
+        off=off, on=on, extra=(on - off) / off * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+'''
+compare the time and the peak memory of rendering a large document read piece
+by piece and read whole, see tests/test_stream.py for the check that both give
+the same html. run with ``python -m benchmarks.stream``.
+'''
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from morphling.parser import MarkdownParser
+
+from benchmarks.corpus import features, generate
+
+
+class _Sink(object):
+    '''
+    a stream that only counts what is written to it
+    '''
+    def __init__(self):
+        self.size = 0
+
+    def write(self, text):
+        self.size += len(text)
+
+
+def run(size):
+    '''
+    return the seconds and the peak memory in bytes of rendering a file of
+    ``size`` characters read whole, and read piece by piece
+    '''
+    content = generate(features, size)
+    with tempfile.NamedTemporaryFile('w', suffix='.md', encoding='utf-8',
+                                     delete=False) as f:
+        f.write(content)
+    del content
+    parser = MarkdownParser()
+
+    def whole():
+        with open(f.name, encoding='utf-8') as source:
+            _Sink().write(parser.render(source.read()))
+
+    def streamed():
+        with open(f.name, encoding='utf-8') as source:
+            parser.render_stream(source, _Sink())
+
+    results = []
+    try:
+        for render in (whole, streamed):
+            gc.collect()
+            tracemalloc.start()
+            try:
+                start = time.time()
+                render()
+                elapsed = time.time() - start
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            results.append((elapsed, peak))
+    finally:
+        os.remove(f.name)
+    return results
+
+
+def main():
+    for size in (1000000, 10000000):
+        (whole, whole_peak), (streamed, streamed_peak) = run(size)
+        print('{size:>9} chars  whole {whole:8.4f}s {whole_peak:9.1f}MB  '
+              'stream {streamed:8.4f}s {streamed_peak:9.1f}MB'.format(
+                  size=size, whole=whole, whole_peak=whole_peak / 1e6,
+                  streamed=streamed, streamed_peak=streamed_peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
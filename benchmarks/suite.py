@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+'''
+time parsing and rendering of generated documents, one case per feature
+'''
+import gc
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from morphling import __version__
+from morphling.reader import read_prepared
+from morphling.renderer import Renderer
+from morphling.scanner import Scanner
+
+from benchmarks import corpus
+
+
+# metrics where a bigger value of the current run is a regression
+compared_metrics = ['parse_seconds', 'render_seconds', 'peak_memory']
+compared_reading_metrics = ['reader_seconds', 'reader_peak_memory']
+
+
+# rows of the single table cases, whatever the size of the other cases
+table_rows = 10000
+
+
+def build_cases(size, seed=0):
+    '''
+    return an ordered dict of case name -> markdown document: one document per
+    feature of the corpus, one that mixes all of them, and a single Table and a
+    single NpTable of ``table_rows`` rows
+    '''
+    cases = OrderedDict()
+    for feature in corpus.features:
+        cases[feature] = corpus.generate([feature], size, seed)
+    cases['mixed'] = corpus.generate(corpus.features, size, seed)
+    cases['table_10k'] = corpus.generate_table(table_rows, seed=seed)
+    cases['nptable_10k'] = corpus.generate_table(table_rows, pipes=False, seed=seed)
+    return cases
+
+
+def build_reading_cases(size, seed=0):
+    '''
+    return an ordered dict of case name -> content of a file to read: the mixed
+    document, which has nothing to prepare, and the same with windows newlines and
+    tabs
+    '''
+    text = corpus.generate(corpus.features, size, seed)
+    return OrderedDict([
+        ('read_mixed', text),
+        ('read_crlf_tabs', text.replace('    ', '\t').replace('\n', '\r\n')),
+    ])
+
+
+def _parse(text):
+    scanner = Scanner()
+    scanner.parse(text)
+    return scanner
+
+
+def _render(scanner, renderer):
+    return ''.join(token.as_html(renderer) for token in scanner.all_tokens)
+
+
+def measure(text, repeat=3):
+    '''
+    time ``Scanner.parse`` and the rendering of its tokens separately, keeping the
+    best of ``repeat`` runs, and trace the peak memory of one more run
+    '''
+    renderer = Renderer()
+    parse_seconds = render_seconds = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        scanner = _parse(text)
+        parsed = time.perf_counter()
+        _render(scanner, renderer)
+        rendered = time.perf_counter()
+        parse_seconds = min(parse_seconds, parsed - start)
+        render_seconds = min(render_seconds, rendered - parsed)
+        del scanner
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        _render(_parse(text), renderer)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    megabytes = len(text.encode('utf-8')) / 1e6
+    return OrderedDict([
+        ('size', len(text)),
+        ('parse_seconds', parse_seconds),
+        ('render_seconds', render_seconds),
+        ('parse_mb_per_second', megabytes / parse_seconds if parse_seconds else 0.0),
+        ('render_mb_per_second', megabytes / render_seconds if render_seconds else 0.0),
+        ('peak_memory', peak_memory),
+    ])
+
+
+def _read_whole(path):
+    # as ``MarkdownParser.parse_file`` read files before morphling.reader
+    with open(path, encoding='utf-8') as source:
+        content = source.read()
+    return Scanner().prepare(content.rstrip('\n'))
+
+
+def _read_prepared(path):
+    return read_prepared(path, Scanner().prepare)
+
+
+def measure_reading(text, repeat=3):
+    '''
+    write the text to a file in utf-8, and time reading it as the source of a
+    scanner whole and with morphling.reader, keeping the best of ``repeat`` runs,
+    and trace the peak memory of one more run of each
+    '''
+    with tempfile.NamedTemporaryFile(
+            'w', suffix='.md', encoding='utf-8', newline='', delete=False) as f:
+        f.write(text)
+    results = OrderedDict([('size', len(text))])
+    try:
+        for name, read in (('read', _read_whole), ('reader', _read_prepared)):
+            seconds = float('inf')
+            for _ in range(repeat):
+                gc.collect()
+                start = time.perf_counter()
+                read(f.name)
+                seconds = min(seconds, time.perf_counter() - start)
+            gc.collect()
+            tracemalloc.start()
+            try:
+                read(f.name)
+                peak_memory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            results[name + '_seconds'] = seconds
+            results[name + '_peak_memory'] = peak_memory
+    finally:
+        os.remove(f.name)
+    return results
+
+
+def run(size=200000, repeat=3, seed=0, names=None, report=None, report_reading=None):
+    '''
+    run the benchmark cases and return the results as a json-serializable dict
+        :params size: size in characters of each generated document
+        :params repeat: number of timed runs per case, the best one is kept
+        :params names: run only these cases
+        :params report: called with (case name, results) after each case
+        :params report_reading: called with (case name, results) after each case of
+                                reading a file
+    '''
+    results = OrderedDict()
+    results['meta'] = OrderedDict([
+        ('morphling', __version__),
+        ('python', platform.python_version()),
+        ('implementation', platform.python_implementation()),
+        ('size', size),
+        ('repeat', repeat),
+        ('seed', seed),
+    ])
+    results['cases'] = OrderedDict()
+    for name, text in build_cases(size, seed).items():
+        if names and name not in names:
+            continue
+        results['cases'][name] = measure(text, repeat)
+        if report is not None:
+            report(name, results['cases'][name])
+    results['reading'] = OrderedDict()
+    for name, text in build_reading_cases(size, seed).items():
+        if names and name not in names:
+            continue
+        results['reading'][name] = measure_reading(text, repeat)
+        if report_reading is not None:
+            report_reading(name, results['reading'][name])
+    return results
+
+
+def compare(baseline, current, threshold=0.1):
+    '''
+    compare two results of ``run``, return the regressions as a list of messages.
+    a metric of ``compared_metrics`` regresses when it grows by more than
+    ``threshold`` (a fraction) over the baseline.
+    '''
+    regressions = []
+    for section, metrics in (('cases', compared_metrics),
+                             ('reading', compared_reading_metrics)):
+        for name, case in current.get(section, {}).items():
+            old = baseline.get(section, {}).get(name)
+            if old is None:
+                continue
+            for metric in metrics:
+                if not old.get(metric):
+                    continue
+                change = case[metric] / float(old[metric]) - 1
+                if change > threshold:
+                    regressions.append('%s: %s %.4g -> %.4g (+%.1f%%)' % (
+                        name, metric, old[metric], case[metric], change * 100))
+    return regressions
@@ -1,34 +1,49 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import sys
 import getopt
 from morphling.parser import MarkdownParser
+from morphling.scanner import Scanner
+from morphling.stats import ScannerStats
+from morphling import batch
 
 
 def print_usage():
     print('''Usage: python -m morphling  FILE_PATH [OPTIONS...]
+       python -m morphling  FILE_PATH|DIRECTORY|GLOB... [OPTIONS...]
 Morphling is a tool that converts markdown to html files.
+Several sources, a directory or a glob pattern are converted in batch mode.
 Options:
-  -o/--output=OUTPUT FILE        path to output file
+  -o/--output=OUTPUT FILE        path to output file, or output directory in batch mode
   -e/--escape=no                 specify if you don't need to escape
+  -j/--jobs=N                    number of worker processes in batch mode,
+                                 defaults to the number of cpus. with a single
+                                 file, parse it over that many processes
+  -p/--profile                   print the time spent on each token class,
+                                 batch mode then runs in a single process
+  -s/--stream                    read a single file piece by piece and write the
+                                 html as it goes, in bounded memory
 ''')
 
 
+def print_failure(source, error):
+    sys.stderr.write('failed: %s: %s\n' % (source, error))
+
+
 def main():
     do_not_escape = True
     try:
-        source_file = sys.argv[1]
-    except IndexError:
-        print('source file not specified.')
-        print_usage()
-        sys.exit(2)
-    output_path = '.'.join([source_file.split('.')[0], 'html'])
-    try:
-        opts, args = getopt.getopt(sys.argv[2:], 'ho:e:', ['help', 'output=', 'escape='])
+        opts, sources = getopt.gnu_getopt(
+            sys.argv[1:], 'ho:e:j:ps', ['help', 'output=', 'escape=', 'jobs=', 'profile', 'stream'])
     except getopt.GetoptError as e:
         print(str(e))
         sys.exit(2)
+    output_path = None
+    jobs = None
+    stats = None
+    stream = False
     for o, a in opts:
         if o in ('-h', '--help'):
             print_usage()
@@ -37,8 +52,50 @@ def main():
             do_not_escape = False
         if o in ('-o', '--output'):
             output_path = a
-    mdp = MarkdownParser(source_path=source_file, output_path=output_path, escape=do_not_escape)
-    mdp.parse_file()
+        if o in ('-j', '--jobs'):
+            try:
+                jobs = int(a)
+            except ValueError:
+                jobs = 0
+            if jobs < 1:
+                print('invalid number of jobs: %s' % a)
+                sys.exit(2)
+        if o in ('-p', '--profile'):
+            stats = ScannerStats()
+        if o in ('-s', '--stream'):
+            stream = True
+    if not sources:
+        print('source file not specified.')
+        print_usage()
+        sys.exit(2)
+
+    source_file = sources[0]
+    if len(sources) == 1 and os.path.isfile(source_file):
+        if output_path is None:
+            output_path = '.'.join([source_file.split('.')[0], 'html'])
+        if stream:
+            mdp = MarkdownParser(escape=do_not_escape)
+            with open(source_file, encoding='utf-8') as source, \
+                    open(output_path, 'w', encoding='utf-8') as output:
+                mdp.render_stream(source, output)
+            return
+        mdp = MarkdownParser(
+            scanner=Scanner(stats=stats), source_path=source_file, output_path=output_path,
+            escape=do_not_escape, workers=jobs)
+        mdp.parse_file()
+        if stats is not None:
+            print(stats.table())
+        return
+
+    result = batch.convert(
+        sources, output_dir=output_path, workers=jobs, escape=do_not_escape,
+        on_failure=print_failure, stats=stats)
+    if stats is not None:
+        print(stats.table())
+    print(result.summary())
+    if result.failures:
+        sys.exit(1)
 
 
-main()
+if __name__ == '__main__':
+    main()
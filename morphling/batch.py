@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+'''
+convert many markdown files at once, spreading the work over a pool of processes
+'''
+import glob
+import os
+import time
+from multiprocessing import Pool
+
+from morphling.parser import MarkdownParser
+from morphling.scanner import Scanner
+
+
+markdown_extensions = ('.md', '.markdown', '.mdown', '.mkd')
+
+# the parser of a worker process, see ``_init_worker``
+_parser = None
+
+
+def _has_magic(path):
+    return any(c in path for c in '*?[')
+
+
+def _html_path(path):
+    return os.path.splitext(path)[0] + '.html'
+
+
+def collect_sources(paths):
+    '''
+    expand files, directories and glob patterns into a list of
+    (source path, path relative to the output directory) pairs.
+        :params paths: markdown files, directories or glob patterns. directories are
+                       walked for files with one of ``markdown_extensions``
+    '''
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(markdown_extensions):
+                        source = os.path.join(root, name)
+                        sources.append((source, os.path.relpath(source, path)))
+        elif _has_magic(path):
+            # keep the layout below the part of the pattern without wildcards
+            base = path
+            while _has_magic(base):
+                base = os.path.dirname(base)
+            for source in sorted(glob.glob(path, recursive=True)):
+                if os.path.isfile(source):
+                    sources.append((source, os.path.relpath(source, base or '.')))
+        else:
+            sources.append((path, os.path.basename(path)))
+    return sources
+
+
+def _init_worker(escape, stats=None, limits=None):
+    global _parser
+    _parser = MarkdownParser(scanner=Scanner(stats=stats, limits=limits), escape=escape)
+
+
+def _convert(job):
+    '''
+    convert one file, return (source path, size of the source in bytes, error)
+    '''
+    source, target = job
+    try:
+        with open(source, 'r', encoding='utf-8') as f:
+            content = f.read()
+        html = _parser.render(content)
+        directory = os.path.dirname(target)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by another worker in the meantime
+                if not os.path.isdir(directory):
+                    raise
+        with open(target, 'w', encoding='utf-8') as f:
+            f.write(html)
+        return source, os.path.getsize(source), None
+    except Exception as e:
+        return source, 0, '%s: %s' % (e.__class__.__name__, e)
+
+
+class BatchResult(object):
+    '''
+    summary of a batch conversion
+    '''
+    def __init__(self):
+        self.converted = 0
+        self.size = 0
+        self.seconds = 0.0
+        self.failures = []  # (source path, error message)
+
+    @property
+    def files_per_second(self):
+        return self.converted / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_per_second(self):
+        return self.size / 1e6 / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        return (
+            'converted {files} files ({failed} failed) in {secs:.2f}s: '
+            '{fps:.1f} files/s, {mbps:.2f} MB/s'
+        ).format(files=self.converted, failed=len(self.failures), secs=self.seconds,
+                 fps=self.files_per_second, mbps=self.mb_per_second)
+
+
+def convert(paths, output_dir=None, workers=None, escape=True, on_failure=None, stats=None,
+            limits=None):
+    '''
+    convert markdown files to html with a pool of worker processes.
+    a file that fails to convert is reported and does not stop the others, and so
+    is a file whose html would overwrite the one of another file given.
+        :params paths: markdown files, directories or glob patterns
+        :params output_dir: the directory the html files are written to, keeping
+                            the layout of the sources. without it each html file is
+                            written next to its source
+        :params workers: number of worker processes, defaults to the number of cpus
+        :params escape: passed to the renderer
+        :params on_failure: called with (source path, error message) for each failure
+        :params stats: an instance of morphling.stats.ScannerStats to profile the
+                       conversion. the files are then converted in this process
+        :params limits: an instance of morphling.limits.Limits, a file that goes over
+                        them is reported as a failure
+    '''
+    result = BatchResult()
+    jobs = []
+    # target path -> source path, a source given twice is converted once
+    targets = {}
+    for source, relative in collect_sources(paths):
+        if output_dir is None:
+            target = _html_path(source)
+        else:
+            target = os.path.join(output_dir, _html_path(relative))
+        key = os.path.normcase(os.path.abspath(target))
+        if key in targets:
+            if os.path.realpath(targets[key]) != os.path.realpath(source):
+                error = 'same output %s as %s' % (target, targets[key])
+                result.failures.append((source, error))
+                if on_failure is not None:
+                    on_failure(source, error)
+            continue
+        targets[key] = source
+        jobs.append((source, target))
+
+    start = time.time()
+    if workers == 1 or stats is not None:
+        _init_worker(escape, stats, limits)
+        outcomes = map(_convert, jobs)
+        pool = None
+    else:
+        pool = Pool(workers, initializer=_init_worker, initargs=(escape, None, limits))
+        outcomes = pool.imap_unordered(_convert, jobs, chunksize=8)
+    try:
+        for source, size, error in outcomes:
+            if error is None:
+                result.converted += 1
+                result.size += size
+            else:
+                result.failures.append((source, error))
+                if on_failure is not None:
+                    on_failure(source, error)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    result.seconds = time.time() - start
+    return result
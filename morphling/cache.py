@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+'''
+cache of rendered html for MarkdownParser created with ``cache=RenderCache(...)``
+'''
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class MemoryBackend(object):
+    '''
+    keep the html in a dict, the default backend of RenderCache
+    '''
+    def __init__(self):
+        self._entries = {}
+
+    def entries(self):
+        '''
+        return the (key, size in bytes) of the stored entries, least recently used first
+        '''
+        return []
+
+    def load(self, key):
+        return self._entries.get(key)
+
+    def store(self, key, html):
+        '''
+        store the html, return its size in bytes
+        '''
+        self._entries[key] = html
+        return sys.getsizeof(html)
+
+    def remove(self, key):
+        self._entries.pop(key, None)
+
+    def touch(self, key):
+        '''
+        mark the entry as used
+        '''
+        pass
+
+
+class DirectoryBackend(object):
+    '''
+    keep the html in files of a directory, named after their keys, so that the
+    cache outlives the process. the entries found in the directory are loaded
+    in the order of their modification times, which ``touch`` updates.
+    the directory should be used by one process at a time.
+        :params path: the directory, created if it does not exist
+    '''
+    suffix = '.html'
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _path(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+    def entries(self):
+        found = []
+        for name in os.listdir(self.path):
+            if not name.endswith(self.suffix):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            found.append((stat.st_mtime, name[:-len(self.suffix)], stat.st_size))
+        found.sort()
+        return [(key, size) for _, key, size in found]
+
+    def load(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read().decode('utf-8')
+        except (IOError, OSError):
+            return None
+
+    def store(self, key, html):
+        data = html.encode('utf-8')
+        # write to a temporary file first, a reader never sees half of the html
+        fd, temporary = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, self._path(key))
+        except Exception:
+            os.remove(temporary)
+            raise
+        return len(data)
+
+    def remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def touch(self, key):
+        try:
+            os.utime(self._path(key), None)
+        except OSError:
+            pass
+
+
+class RenderCache(object):
+    '''
+    cache of html by key, evicting the least recently used entries beyond
+    ``max_entries`` entries or ``max_bytes`` bytes. it can be shared between
+    threads.
+        :params backend: where the html is stored, a MemoryBackend by default
+        :params max_entries: maximum number of entries, None for no limit
+        :params max_bytes: maximum size of the entries in bytes, None for no limit.
+                           html bigger than that is not cached
+    '''
+    def __init__(self, backend=None, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._lock = threading.Lock()
+        # key -> size in bytes, least recently used first
+        self._index = OrderedDict()
+        with self._lock:
+            for key, size in self.backend.entries():
+                self._index[key] = size
+                self.size += size
+            self._evict()
+
+    @staticmethod
+    def key(content, *config):
+        '''
+        return the key of a markdown content rendered with the given configuration
+        '''
+        digest = hashlib.sha256()
+        for part in config:
+            digest.update(repr(part).encode('utf-8'))
+            digest.update(b'\0')
+        digest.update(content.encode('utf-8'))
+        return digest.hexdigest()
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, key):
+        '''
+        return the html of the key, or None
+        '''
+        with self._lock:
+            if key in self._index:
+                html = self.backend.load(key)
+                if html is not None:
+                    self._index.move_to_end(key)
+                    self.backend.touch(key)
+                    self.hits += 1
+                    return html
+                # removed from the backend behind our back
+                self.size -= self._index.pop(key)
+            self.misses += 1
+            return None
+
+    def set(self, key, html):
+        '''
+        store the html of the key, evicting other entries if needed
+        '''
+        with self._lock:
+            if key in self._index:
+                self.size -= self._index.pop(key)
+            size = self.backend.store(key, html)
+            if self.max_bytes is not None and size > self.max_bytes:
+                self.backend.remove(key)
+                return
+            self._index[key] = size
+            self.size += size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            for key in self._index:
+                self.backend.remove(key)
+            self._index.clear()
+            self.size = 0
+
+    def _evict(self):
+        while self._index and (
+                (self.max_entries is not None and len(self._index) > self.max_entries) or
+                (self.max_bytes is not None and self.size > self.max_bytes)):
+            key, size = self._index.popitem(last=False)
+            self.backend.remove(key)
+            self.size -= size
+            self.evictions += 1
+
+    def summary(self):
+        return (
+            '{entries} entries, {size} bytes: '
+            '{hits} hits, {misses} misses, {evictions} evictions'
+        ).format(entries=len(self._index), size=self.size, hits=self.hits,
+                 misses=self.misses, evictions=self.evictions)
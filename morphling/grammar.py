@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+'''
+compile a list of token classes into the tables the scanner dispatches on
+'''
+import re
+from operator import attrgetter
+
+from morphling.token import TokenBase
+
+
+# what a Grammar is compiled from besides the token classes, see ``Grammar.is_current``
+_compiled_attributes = attrgetter('regex', 'leading_chars')
+_backref_regex = re.compile(r'\\([1-9][0-9]?)')
+_condition_regex = re.compile(r'\(\?\(([1-9][0-9]*)\)')
+
+
+def shift_groups(pattern, offset):
+    '''
+    renumber the group references of a pattern, ``\\1`` and ``(?(1)...)``, by
+    ``offset``, for the pattern to be embedded after ``offset`` other groups
+    '''
+    output = []
+    i = 0
+    in_class = False
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            backref = None if in_class else _backref_regex.match(pattern, i)
+            if backref:
+                output.append('\\%d' % (int(backref.group(1)) + offset))
+                i = backref.end()
+            else:
+                output.append(pattern[i:i + 2])
+                i += 2
+            continue
+        if in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+            # a ] right after [ or [^ does not close the class
+            end = i + 1
+            if pattern.startswith('^', end):
+                end += 1
+            if pattern.startswith(']', end):
+                end += 1
+            output.append(pattern[i:end])
+            i = end
+            continue
+        elif char == '(':
+            condition = _condition_regex.match(pattern, i)
+            if condition:
+                output.append('(?(%d)' % (int(condition.group(1)) + offset))
+                i = condition.end()
+                continue
+        output.append(char)
+        i += 1
+    return ''.join(output)
+
+
+def combinable(token_class):
+    '''
+    check whether the pattern of a token class can be merged with others: the
+    token class must match with ``TokenBase.match``, and its pattern must have no
+    flags or named groups of its own
+    '''
+    if getattr(token_class.match, '__func__', None) is not TokenBase.match.__func__:
+        return False
+    regex = token_class.offset_regex()
+    return regex.flags == re.compile('').flags and '(?P' not in regex.pattern
+
+
+class Alternation(object):
+    '''
+    token classes matched at once with a single regex, in which the pattern of
+    each of them is an alternative named after its index. like trying them one by
+    one, the first one that matches wins.
+        :params token_classes: the token classes, all of them ``combinable``
+    '''
+    def __init__(self, token_classes):
+        self.token_classes = tuple(token_classes)
+        alternatives = []
+        groups = 0
+        # group name -> (token class, whether the token needs a match of its own
+        # pattern to read its groups)
+        self._groups = {}
+        for index, token_class in enumerate(self.token_classes):
+            regex = token_class.offset_regex()
+            name = 't%d' % index
+            alternatives.append('(?P<%s>%s)' % (name, shift_groups(regex.pattern, groups + 1)))
+            groups += regex.groups + 1
+            self._groups[name] = token_class, bool(regex.groups) or token_class.retain_match
+        self.regex = re.compile('|'.join(alternatives))
+
+    def match(self, source, scanner=None, pos=0):
+        '''
+        return the token of the first token class that matches at ``pos``, or None
+        '''
+        match = self.regex.match(source, pos)
+        if not match:
+            return None
+        token_class, rematch = self._groups[match.lastgroup]
+        if rematch:
+            # the token reads the groups of its own pattern
+            match = token_class.offset_regex().match(source, pos)
+            if not match:
+                # the regex of the class changed since the alternation was compiled
+                return None
+        return token_class(match, scanner=scanner)
+
+    def __repr__(self):
+        return '<Alternation of %s>' % ', '.join(c.__name__ for c in self.token_classes)
+
+
+def combine(token_classes):
+    '''
+    return the token classes with each run of combinable ones replaced by their
+    Alternation, in the same order
+    '''
+    matchers = []
+    run = []
+    for token_class in token_classes:
+        if combinable(token_class):
+            run.append(token_class)
+            continue
+        matchers.extend(_combine_run(run))
+        run = []
+        matchers.append(token_class)
+    matchers.extend(_combine_run(run))
+    return tuple(matchers)
+
+
+def _combine_run(run):
+    if len(run) < 2:
+        return run
+    return [Alternation(run)]
+
+
+def leading_chars(token_class):
+    '''
+    return the ``leading_chars`` of a token class, or None when they were declared
+    for the regex of a base class that the token class replaces
+    '''
+    for cls in token_class.__mro__:
+        if 'leading_chars' in cls.__dict__:
+            return cls.__dict__['leading_chars']
+        if 'regex' in cls.__dict__:
+            return None
+    return None
+
+
+class Grammar(object):
+    '''
+    a list of token classes compiled for the scanner.
+    ``table`` maps the first character at a position to the token classes to try
+    there, and ``fallback`` holds the token classes to try for any other character,
+    see ``TokenBase.leading_chars``. Both keep the order of the list.
+    ``combined_table`` and ``combined_fallback`` are the same with the runs of token
+    classes that can be merged replaced by an Alternation, so that one regex
+    match tries all of them.
+        :params token_classes: the token classes, in the order they are tried
+    '''
+    def __init__(self, token_classes):
+        self.token_classes = tuple(token_classes)
+        # what the grammar is compiled from, see ``is_current``
+        self._compiled_from = list(map(_compiled_attributes, self.token_classes))
+        leading = dict((token_class, leading_chars(token_class))
+                       for token_class in self.token_classes)
+        chars = set()
+        for token_class in self.token_classes:
+            chars.update(leading[token_class] or '')
+        self.table = {}
+        for char in chars:
+            self.table[char] = tuple(
+                token_class for token_class in self.token_classes
+                if not leading[token_class] or char in leading[token_class])
+        self.fallback = tuple(
+            token_class for token_class in self.token_classes
+            if not leading[token_class])
+
+        # chars with the same token classes share their alternations
+        combined = {}
+        self.combined_table = {}
+        for char, token_classes in self.table.items():
+            if token_classes not in combined:
+                combined[token_classes] = combine(token_classes)
+            self.combined_table[char] = combined[token_classes]
+        self.combined_fallback = combine(self.fallback)
+
+    def is_current(self):
+        '''
+        check that none of the token classes had its ``regex`` or ``leading_chars``
+        set again since the grammar was compiled
+        '''
+        return list(map(_compiled_attributes, self.token_classes)) == self._compiled_from
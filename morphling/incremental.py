@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+'''
+incremental parsing for live previews: a Document keeps the top-level blocks of
+a content with their tokens and html, and ``Document.edit`` parses again only the
+blocks around an edit
+'''
+import re
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, chain
+
+from morphling.token import BlockFootnote, BlockHtml, BlockLink, Fence, InlineFootnote
+
+
+# where a fence, a html block or a link or footnote definition whose key goes on
+# to the next line may start: the token classes tried there look for their end
+# anywhere further down
+_opener_regex = re.compile(r' *(?:```|~~~|<|\[[^\]\n]*(?:\n|$))')
+# a paragraph goes on over a fence that is never closed
+_fence_line_regex = re.compile(r'^ *(?:```|~~~)', re.M)
+_openers = (Fence, BlockHtml, BlockLink, BlockFootnote)
+
+# how many lines before an edit the blocks ending there may have looked at,
+# e.g. a paragraph checks the two lines after it for a setext heading
+_lookbehind_lines = 3
+
+_chunk_size = 4096
+
+
+def _common_prefix(a, b):
+    '''
+    return the length of the common prefix of two strings
+    '''
+    size = min(len(a), len(b))
+    i = 0
+    while i + _chunk_size <= size and a[i:i + _chunk_size] == b[i:i + _chunk_size]:
+        i += _chunk_size
+    # the first difference is in the next chunk
+    low, high = i, min(i + _chunk_size, size)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[i:middle] == b[i:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _common_suffix(a, b, limit):
+    '''
+    return the length of the common suffix of two strings, at most ``limit``
+    '''
+    i = 0
+    while (i + _chunk_size <= limit and
+           a[len(a) - i - _chunk_size:len(a) - i] == b[len(b) - i - _chunk_size:len(b) - i]):
+        i += _chunk_size
+    low, high = i, min(i + _chunk_size, limit)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:len(a) - i] == b[len(b) - middle:len(b) - i]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class Block(object):
+    '''
+    a top-level token of a document with the tokens it nests, its footnotes and
+    link definitions, and their html once rendered
+        :params length: the length of the block in the prepared source
+        :params far_reaching: whether the block starts like a fence, a html block
+                              or a definition, or has a fence line, without being
+                              one: what happens to the source after it, however
+                              far, may change it
+    '''
+    __slots__ = (
+        'length', 'far_reaching', 'tokens', 'footnotes', 'links', 'refs', 'reads_definitions',
+        'html', 'footnotes_html')
+
+    def __init__(self, length, tokens, footnotes, links, far_reaching=False):
+        self.length = length
+        self.far_reaching = far_reaching
+        self.tokens = tokens
+        self.footnotes = footnotes
+        self.links = links
+        # footnote references, numbered in the order of the document
+        self.refs = [
+            token for token in chain(tokens, footnotes) if isinstance(token, InlineFootnote)]
+        self.reads_definitions = any(token.reads_definitions for token in chain(tokens, footnotes))
+        self.html = None
+        self.footnotes_html = None
+
+    def definitions(self):
+        '''
+        return what the tokens that read definitions see of the ones of the block
+        '''
+        return (
+            [(link.ref_key, link.link) for link in self.links],
+            [token.key for token in self.footnotes
+             if isinstance(token, BlockFootnote) and token.is_head])
+
+
+def _far_reaching(source, pos, end, tokens, footnotes, links):
+    '''
+    return whether the top-level token parsed from ``pos`` to ``end`` of the source,
+    with the tokens it nests, may change with what comes after it, however far
+    '''
+    head = (tokens or footnotes or links or [None])[0]
+    if isinstance(head, BlockHtml) and head.open_tag:
+        # a tag matched without its closing tag, which may come later
+        return True
+    return not isinstance(head, _openers) and bool(
+        _opener_regex.match(source, pos) or _fence_line_regex.search(source, pos, end))
+
+
+def _definitions(blocks):
+    return [block.definitions() for block in blocks if block.links or block.footnotes]
+
+
+class Document(object):
+    '''
+    the parse result of a markdown content, made by ``MarkdownParser.parse_document``
+    and updated in place by ``edit``. the content is split in the top-level blocks
+    of the scanner's ``default_regex``, each of them rendered on its own.
+        :params content: text content in markdown language
+        :params scanner: the scanner of the document, it keeps the definitions
+        :params renderer: an instance of morphling.renderer.Renderer
+    '''
+    def __init__(self, content, scanner, renderer):
+        self.content = content
+        self.scanner = scanner
+        self.renderer = renderer
+        self.source = scanner.prepare(content.rstrip('\n'))
+        self.blocks = self._parse(0, 0)
+        self.rendered = 0  # number of blocks rendered by the last update
+        self._index_definitions()
+        self._render()
+
+    @property
+    def html(self):
+        blocks = self.blocks
+        return ''.join([block.html for block in blocks]) + ''.join(
+            [block.footnotes_html for block in blocks])
+
+    def edit(self, offset, deleted, inserted):
+        '''
+        apply an edit to the content and parse again the blocks it may change.
+        the footnote references after them are renumbered, and the blocks that read
+        definitions are rendered again only when the definitions changed.
+            :params offset: where the edit starts in the content
+            :params deleted: the number of characters removed from there
+            :params inserted: the text inserted there
+        '''
+        if offset < 0 or deleted < 0 or offset + deleted > len(self.content):
+            raise ValueError('invalid edit')
+        self.content = self.content[:offset] + inserted + self.content[offset + deleted:]
+        # preparing is cheap next to parsing, and it may join or split lines
+        old, source = self.source, self.scanner.prepare(self.content.rstrip('\n'))
+        self.source = source
+        start = _common_prefix(old, source)
+        if start == len(old) == len(source):
+            self.rendered = 0
+            return
+        suffix = _common_suffix(old, source, min(len(old), len(source)) - start)
+        old_end = len(old) - suffix
+        end = len(source) - suffix
+        blocks = self.blocks
+        starts = list(accumulate(chain((0,), (block.length for block in blocks))))
+        line = start
+        for _ in range(_lookbehind_lines):
+            line = max(source.rfind('\n', 0, line), 0)
+        # one more block, the one before may have looked into it
+        first = max(bisect_right(starts, line) - 2, 0)
+        for index in range(first):
+            if blocks[index].far_reaching:
+                first = index
+                break
+        delta = end - old_end
+
+        def resumes(pos):
+            # past the edit, the blocks of the old source are found again
+            if pos < end:
+                return False
+            index = bisect_left(starts, pos - delta)
+            return index < len(blocks) and starts[index] == pos - delta
+
+        refs = sum(len(block.refs) for block in blocks[:first])
+        parsed = self._parse(starts[first], refs, resumes)
+        pos = starts[first] + sum(block.length for block in parsed)
+        last = bisect_left(starts, pos - delta) if pos < len(source) else len(blocks)
+        replaced = blocks[first:last]
+        blocks[first:last] = parsed
+
+        shift = (sum(len(block.refs) for block in parsed) -
+                 sum(len(block.refs) for block in replaced))
+        if shift:
+            for block in blocks[first + len(parsed):]:
+                if block.refs:
+                    for ref in block.refs:
+                        ref.index += shift
+                    block.html = None
+        if _definitions(replaced) or _definitions(parsed):
+            # parsing added the new definitions over the ones further down
+            self._index_definitions()
+            if _definitions(replaced) != _definitions(parsed):
+                for block in blocks:
+                    if block.reads_definitions:
+                        block.html = None
+        self._render()
+
+    def _parse(self, pos, refs, stop=None):
+        '''
+        parse the blocks of the source from ``pos``, until ``stop`` returns True for
+        the position after one of them, and return them
+            :params refs: the number of footnote references before ``pos``
+        '''
+        scanner = self.scanner
+        scanner.footnote_refs = refs
+        scanner.take_parsed()
+        blocks = []
+        iterator = scanner.iter_blocks(self.source, pos)
+        try:
+            for end in iterator:
+                tokens, footnotes, links = scanner.take_parsed()
+                far_reaching = _far_reaching(self.source, pos, end, tokens, footnotes, links)
+                blocks.append(Block(end - pos, tokens, footnotes, links, far_reaching))
+                pos = end
+                if stop is not None and stop(pos):
+                    break
+        finally:
+            iterator.close()
+        return blocks
+
+    def _index_definitions(self):
+        '''
+        index the definitions of all the blocks in the scanner, the last one of a
+        key wins as in ``Scanner.add_link``
+        '''
+        self.scanner.reindex(
+            [link for block in self.blocks for link in block.links],
+            [token for block in self.blocks for token in block.footnotes])
+
+    def _render(self):
+        renderer = self.renderer
+        rendered = 0
+        for block in self.blocks:
+            if block.html is None:
+                block.html = ''.join([token.as_html(renderer) for token in block.tokens])
+                block.footnotes_html = ''.join(
+                    [token.as_html(renderer) for token in block.footnotes])
+                rendered += 1
+        self.rendered = rendered
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+'''
+limits of the work spent on one document, for a Scanner created with ``limits=Limits(...)``
+'''
+
+
+class LimitExceeded(RuntimeError):
+    '''
+    raised by the scanner when a document goes over one of its limits
+        :params name: the name of the limit, one of the attributes of Limits
+        :params value: the value that went over the limit
+        :params maximum: the limit
+    '''
+    def __init__(self, name, value, maximum):
+        super(LimitExceeded, self).__init__(
+            '%s limit exceeded: %s > %s' % (name, value, maximum))
+        self.name = name
+        self.value = value
+        self.maximum = maximum
+
+
+class Limits(object):
+    '''
+    limits of a document, a limit left to None is not checked.
+        :params max_size: number of characters of the source
+        :params max_tokens: number of tokens, link definitions and footnotes included
+        :params max_depth: nesting of the parse calls, block quotes, lists, footnotes
+                           and inline content each parse their content one level deeper
+        :params max_seconds: wall-clock time of the parsing
+    '''
+    def __init__(self, max_size=None, max_tokens=None, max_depth=None, max_seconds=None):
+        self.max_size = max_size
+        self.max_tokens = max_tokens
+        self.max_depth = max_depth
+        self.max_seconds = max_seconds
+
+    def check(self, name, value):
+        '''
+        raise LimitExceeded if value is over the limit of the given name
+        '''
+        maximum = getattr(self, name)
+        if maximum is not None and value > maximum:
+            raise LimitExceeded(name, value, maximum)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+'''
+parse one large document over a pool of processes: the prepared source is split
+at blank lines that likely end a top-level block, each chunk is parsed by a
+worker, and the tokens are merged in order. the definitions and the footnote
+numbers are resolved once everything is merged, so the html is the same as
+with ``Scanner.parse``.
+
+a chunk is parsed from its start until a top-level token ends at or past the
+start of the next chunk, with the whole source in view. where a chunk was not
+split at a boundary of the serial parse, the tokens of the next chunk are taken
+from the first top-level token the two parses agree on, or the source is parsed
+in this process until they do.
+'''
+import gc
+import re
+from bisect import bisect_left
+from multiprocessing import Pool, cpu_count
+
+from morphling.token import InlineFootnote
+
+
+# chunks are never smaller than that, in characters of the prepared source
+min_chunk_size = 256 * 1024
+
+# a blank line followed by a line that does not go on with a list, a block quote,
+# an indented block or a table
+_split_regex = re.compile(r'\n\n+(?![ \n>*+\-\d|])')
+_fence_line_regex = re.compile(r'^ *(?:```|~~~)', re.M)
+
+# the scanner and the prepared source of a worker process, see ``_init_worker``
+_scanner = None
+_source = None
+
+
+def split(source, count, min_size=min_chunk_size):
+    '''
+    return the offsets where the chunks of the prepared source start, at most
+    ``count`` chunks of at least ``min_size`` characters. a chunk starts after a
+    blank line outside a fence, as far as an even number of fence lines before it
+    tells
+    '''
+    size = max(len(source) // max(count, 1), min_size)
+    fences = [match.start() for match in _fence_line_regex.finditer(source)]
+    starts = [0]
+    pos = size
+    while pos < len(source):
+        match = _split_regex.search(source, pos)
+        while match and bisect_left(fences, match.start()) % 2:
+            match = _split_regex.search(source, match.end())
+        if match is None or match.end() >= len(source):
+            break
+        starts.append(match.end())
+        pos = match.end() + size
+    return starts
+
+
+def _parse_blocks(scanner, source, pos, stop):
+    '''
+    parse top-level tokens of the prepared source from ``pos`` until ``stop``
+    returns True for the position after one of them. return the tokens, footnotes
+    and links, and for each top-level token the position after it with the numbers
+    of tokens, footnotes, links and footnote references up to there
+    '''
+    scanner.clear()
+    blocks = []
+    iterator = scanner.iter_blocks(source, pos)
+    try:
+        for end in iterator:
+            blocks.append((
+                end, len(scanner.tokens), len(scanner.footnotes), len(scanner.links),
+                scanner.footnote_refs))
+            if stop(end):
+                break
+    finally:
+        iterator.close()
+    return blocks, scanner.tokens, scanner.footnotes, scanner.links
+
+
+def _init_worker(scanner, source):
+    global _scanner, _source
+    _scanner = scanner
+    _source = source
+
+
+def _parse_chunk(chunk):
+    '''
+    parse the chunk (start, start of the next chunk) of the source, the tokens
+    leave their scanner behind to be sent back
+    '''
+    start, stop = chunk
+    parsed = _parse_blocks(_scanner, _source, start, lambda end: end >= stop)
+    for tokens in parsed[1:]:
+        for token in tokens:
+            token.scanner = None
+    return parsed
+
+
+class _Merge(object):
+    '''
+    the tokens of the chunks put back in the order of the document
+    '''
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self.pos = 0
+        self.tokens = []
+        self.footnotes = []
+        self.links = []
+        self.refs = 0
+
+    def add(self, parsed, first):
+        '''
+        take the top-level tokens of a chunk from index ``first`` on
+        '''
+        blocks, tokens, footnotes, links = parsed
+        if first:
+            _, token_start, footnote_start, link_start, refs = blocks[first - 1]
+        else:
+            token_start = footnote_start = link_start = refs = 0
+        end, token_end, footnote_end, link_end, refs_end = blocks[-1]
+        shift = self.refs - refs
+        scanner = self.scanner
+        for taken, added in ((tokens[token_start:token_end], self.tokens),
+                             (footnotes[footnote_start:footnote_end], self.footnotes)):
+            for token in taken:
+                token.scanner = scanner
+                if shift and isinstance(token, InlineFootnote):
+                    token.index += shift
+            added.extend(taken)
+        for link in links[link_start:link_end]:
+            link.scanner = scanner
+            self.links.append(link)
+        self.refs += refs_end - refs
+        self.pos = end
+
+    def add_chunk(self, source, start, parsed):
+        '''
+        take the top-level tokens of the chunk parsed from ``start`` that come
+        after the position reached so far
+        '''
+        blocks = parsed[0]
+        ends = [block[0] for block in blocks]
+        while ends and self.pos < ends[-1]:
+            if self.pos == start:
+                self.add(parsed, 0)
+                return
+            index = bisect_left(ends, self.pos)
+            if index < len(ends) and ends[index] == self.pos:
+                self.add(parsed, index + 1)
+                return
+            # the chunk was not split at a boundary of the serial parse: parse until
+            # a top-level token ends where one of the chunk does
+            known = set(ends)
+            known.add(start)
+            last = ends[-1]
+            self.add(_parse_blocks(
+                self.scanner.spawn(), source, self.pos,
+                lambda end: end in known or end >= last), 0)
+
+    def finish(self):
+        '''
+        set the merged tokens on the scanner and index the definitions of the whole
+        document, the last one of a key wins as in ``Scanner.add_link``
+        '''
+        self.scanner.set_parsed(self.tokens, self.footnotes, self.links, self.refs)
+
+
+def parse(scanner, content, workers=None, min_size=min_chunk_size, prepared=False):
+    '''
+    parse the content with the scanner like ``Scanner.parse``, over a pool of
+    ``workers`` processes. a content too small to be split is parsed in this
+    process, and so is any content when the scanner has stats, limits or records
+    positions.
+        :params scanner: an instance of morphling.scanner.Scanner, cleared
+        :params content: text content in markdown language
+        :params workers: number of worker processes, defaults to the number of cpus
+        :params min_size: the smallest chunk in characters
+        :params prepared: the content was already prepared, see ``Scanner.parse``
+    '''
+    if scanner.stats is not None or scanner.limits is not None or scanner.positions:
+        return scanner.parse(content, prepared=prepared)
+    source = content if prepared else scanner.prepare(content.rstrip('\n'))
+    workers = workers or cpu_count()
+    # a few chunks per worker, so that a slow one does not hold the others
+    starts = split(source, workers * 4, min_size)
+    if len(starts) == 1:
+        return scanner.parse(content, prepared=prepared)
+    pool = Pool(workers, initializer=_init_worker, initargs=(scanner.spawn(), source))
+    # all the tokens received are kept, looking for garbage among them while they
+    # are unpickled doubles the time spent on it
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        chunks = list(zip(starts, starts[1:] + [len(source)]))
+        merge = _Merge(scanner)
+        for (start, _), parsed in zip(chunks, pool.imap(_parse_chunk, chunks)):
+            merge.add_chunk(source, start, parsed)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        if collecting:
+            gc.enable()
+        pool.join()
+    if merge.pos < len(source):
+        merge.add(_parse_blocks(scanner.spawn(), source, merge.pos, lambda end: False), 0)
+    merge.finish()
+    return scanner.tokens
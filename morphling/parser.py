@@ -2,6 +2,13 @@
 
 from morphling.renderer import Renderer
 from morphling.scanner import Scanner
+from morphling.stats import timer
+from morphling.limits import LimitExceeded
+from morphling.token import PlainText
+from morphling.incremental import Document
+from morphling import parallel
+from morphling.stream import StreamRenderer
+from morphling.reader import read_prepared
 
 
 class MarkdownParser(object):
@@ -12,6 +19,15 @@ class MarkdownParser(object):
         :params renderer: an instance of morphling.renderer.Renderer
         :params source_path(string): set if you want to parse from a markdown file
         :params output_path(string): set if you need to output the parsed content as a file
+        :params limits: an instance of morphling.limits.Limits set on the scanner
+        :params fallback(bool): when a document goes over the limits, render it as
+                                escaped text instead of raising LimitExceeded
+        :params cache: an instance of morphling.cache.RenderCache used by ``render``
+        :params positions(bool): record where each token comes from in the document,
+                                 see ``position_index``
+        :params workers(int): parse each document over a pool of that many processes,
+                              see morphling.parallel. documents are parsed in this
+                              process by default
     '''
     scanner_class = Scanner
     renderer_class = Renderer
@@ -19,25 +35,85 @@ class MarkdownParser(object):
     def __init__(self, scanner=None, renderer=None, **kwargs):
         self.source_path = kwargs.pop('source_path', None)
         self.output_path = kwargs.pop('output_path', None)
+        self.fallback = kwargs.pop('fallback', False)
+        self.cache = kwargs.pop('cache', None)
+        limits = kwargs.pop('limits', None)
+        positions = kwargs.pop('positions', None)
+        self.workers = kwargs.pop('workers', None)
         self._scanner = scanner or self.scanner_class()
+        if limits is not None:
+            self._scanner.limits = limits
+        if positions is not None:
+            self._scanner.positions = positions
         self._renderer = renderer or self.renderer_class(**kwargs)
 
-    def _parse(self, content):
+    def _parse(self, content, prepared=False):
         self._scanner.clear()
-        self._scanner.parse(content)
+        self._scan(self._scanner, content, prepared)
 
-    def parse_file(self, path=None):
+    def _scan(self, scanner, content, prepared=False):
+        '''
+        parse the content, return False if it went over the limits and was
+        parsed as plain text instead
+        '''
+        try:
+            if self.workers:
+                parallel.parse(scanner, content, self.workers, prepared=prepared)
+            else:
+                scanner.parse(content, prepared=prepared)
+        except LimitExceeded:
+            if not self.fallback:
+                raise
+            scanner.clear()
+            PlainText.match(content, scanner)
+            return False
+        return True
+
+    def _render_tokens(self, scanner):
+        return ''.join(self._iter_html(scanner))
+
+    def _iter_html(self, scanner):
+        renderer = self._renderer
+        stats = scanner.stats
+        if stats is None:
+            for token in scanner.all_tokens:
+                yield token.as_html(renderer)
+            return
+        for token in scanner.all_tokens:
+            start = timer()
+            html = token.as_html(renderer)
+            stats.record_render(token.__class__, timer() - start)
+            yield html
+
+    def parse_file(self, path=None, encoding='utf-8'):
         '''
         parse markdown file
+        if ``output_path`` is set, the html is streamed to that file token by token
+        and ``output`` is not kept.
+        the file is read already prepared for the scanner, see morphling.reader,
+        unless positions are recorded, which count the characters of the file, or
+        a ``fallback`` may escape the file as it is.
         params:
             :path:  location of markdown file
+            :encoding: encoding of the file
         '''
         if path is None and self.source_path is None:
             raise ValueError("invalid path")
         path = path or self.source_path
-        with open(path, 'r') as source:
-            content = source.read()
-        return self.parse(content)
+        prepared = not (self._scanner.positions or self.fallback)
+        if prepared:
+            content = read_prepared(path, self._scanner.prepare, encoding)
+        else:
+            with open(path, encoding=encoding) as source:
+                content = source.read()
+        self._parse(content, prepared)
+        del content  # the tokens do not need the source any more
+        if not self.output_path:
+            self.output = self._render_tokens(self._scanner)
+            return
+        self.output = None
+        with open(self.output_path, 'w') as f:
+            self._write_html(self._scanner, f)
 
     def parse(self, content):
         '''
@@ -46,11 +122,127 @@ class MarkdownParser(object):
             :content: text content in markdown language
         '''
         self._parse(content)
-        self.output = ''.join(
-            map(lambda t: t.as_html(self._renderer), self._scanner.all_tokens))
+        self.output = self._render_tokens(self._scanner)
         if self.output_path:
             with open(self.output_path, 'w') as f:
                 f.write(self.output)
 
+    def position_index(self):
+        '''
+        return a morphling.positions.PositionIndex of the tokens of the last ``parse``,
+        to find the tokens at an offset of the content. the parser must be created
+        with ``positions=True``.
+        '''
+        return self._scanner.position_index()
+
+    def render(self, content):
+        '''
+        parse markdown content and return the html.
+        unlike ``parse``, it keeps no state on the parser: each call parses with
+        a scanner of its own, so one parser can be shared between threads.
+        with a ``cache``, the html of a content already rendered is taken from it.
+        params:
+            :content: text content in markdown language
+        '''
+        if self.cache is not None:
+            key = self.cache_key(content)
+            html = self.cache.get(key)
+            if html is not None:
+                return html
+        scanner = self._scanner.spawn()
+        parsed = self._scan(scanner, content)
+        html = self._render_tokens(scanner)
+        # the fallback of a document that took too long may not happen next time
+        if self.cache is not None and parsed:
+            self.cache.set(key, html)
+        return html
+
+    def render_stream(self, source, stream):
+        '''
+        render markdown read piece by piece and write the html to a writable text
+        stream as it goes, keeping in memory a few top-level blocks and the link and
+        footnote definitions instead of the whole document, see morphling.stream.
+        like ``render``, it keeps no state on the parser.
+        params:
+            :source: a file object open for reading text, or an iterable of strings
+            :stream: file-like object with a ``write`` method
+        '''
+        StreamRenderer(self._scanner.spawn(), self._renderer).render(source, stream)
+
+    def parse_document(self, content):
+        '''
+        parse markdown content into a morphling.incremental.Document, whose ``html``
+        a live preview keeps up to date with ``reparse``. the document has a scanner
+        of its own.
+        params:
+            :content: text content in markdown language
+        '''
+        scanner = self._scanner.spawn()
+        # the blocks kept across edits would keep the positions of the first source
+        scanner.positions = False
+        return Document(content, scanner, self._renderer)
+
+    def reparse(self, document, offset, deleted, inserted):
+        '''
+        apply an edit to a document made by ``parse_document`` and return it: only
+        the top-level blocks around the edit are parsed and rendered again.
+        params:
+            :document: the Document of the content before the edit
+            :offset: where the edit starts in the content
+            :deleted: the number of characters removed from there
+            :inserted: the text inserted there
+        '''
+        document.edit(offset, deleted, inserted)
+        return document
+
+    def cache_key(self, content):
+        '''
+        return the key of the content in the cache: a hash of the content, the
+        classes of the scanner and the renderer, the token classes of the grammar of
+        the scanner and the escaping option
+        '''
+        scanner = self._scanner
+        renderer = self._renderer
+        grammar = [
+            [_class_path(token_class) for token_class in getattr(scanner, name)]
+            for name in scanner._grammar_names]
+        return self.cache.key(
+            content, _class_path(scanner), _class_path(renderer), grammar,
+            getattr(renderer, '_escape', None))
+
+    def iter_render(self, content):
+        '''
+        parse markdown content and yield the html chunk by chunk, e.g. to stream
+        a response. like ``render``, it keeps no state on the parser.
+        params:
+            :content: text content in markdown language
+        '''
+        scanner = self._scanner.spawn()
+        self._scan(scanner, content)
+        return self._iter_html(scanner)
+
+    def render_to(self, content, stream):
+        '''
+        parse markdown content and write the html to a writable text stream, one
+        token at a time. like ``render``, it keeps no state on the parser.
+        params:
+            :content: text content in markdown language
+            :stream: file-like object with a ``write`` method
+        '''
+        scanner = self._scanner.spawn()
+        self._scan(scanner, content)
+        self._write_html(scanner, stream)
+
+    def _write_html(self, scanner, stream):
+        write = stream.write
+        for chunk in self._iter_html(scanner):
+            if chunk:
+                write(chunk)
+
+
+def _class_path(obj):
+    cls = obj if isinstance(obj, type) else obj.__class__
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
 
 mdp = MarkdownParser()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+'''
+where tokens come from in the document, recorded by a Scanner created with
+``positions=True``: see ``TokenBase.start``, ``end``, ``lineno`` and ``column``
+'''
+import re
+from bisect import bisect_right
+
+
+_line_regex = re.compile(r'\r\n|\r|\n')
+# what ``Scanner.prepare`` turns into a newline
+_prepared_line_regex = re.compile('\r\n|\r|\n|␤')
+
+
+def line_starts(content):
+    '''
+    return the offsets where the lines of the content start
+    '''
+    return [0] + [match.end() for match in _line_regex.finditer(content)]
+
+
+def source_map(content, prepared):
+    '''
+    map the offsets of a prepared source to the content it was prepared from:
+    return None if they are the same, else (offsets in the prepared source,
+    offsets in the content) of the starts of lines, of the spaces of tabs and of
+    the text after them, the offsets in between move together
+    '''
+    if content.startswith(prepared):
+        return None
+    starts = []
+    origins = []
+    start = 0
+    line_start = 0
+    for line in prepared.split('\n'):
+        starts.append(start)
+        origins.append(line_start)
+        brk = _prepared_line_regex.search(content, line_start)
+        line_end = brk.start() if brk else len(content)
+        tab = content.find('\t', line_start, line_end)
+        # a line of spaces and tabs was emptied
+        if tab != -1 and line:
+            column = 0
+            for index in range(line_start, line_end):
+                if content[index] == '\t':
+                    # the spaces of the tab are at the tab
+                    for space in range(column, column + 4 - column % 4):
+                        starts.append(start + space)
+                        origins.append(index)
+                    column += 4 - column % 4
+                    starts.append(start + column)
+                    origins.append(index + 1)
+                else:
+                    column += 1
+        if len(line) != line_end - line_start:
+            # the newline of a line emptied or with tabs
+            starts.append(start + len(line))
+            origins.append(line_end)
+        start += len(line) + 1
+        if brk is None:
+            break
+        line_start = brk.end()
+    return starts, origins
+
+
+def map_offset(mapping, pos):
+    '''
+    return the offset in the content of ``pos`` of a prepared source, see ``source_map``
+    '''
+    starts, origins = mapping
+    index = bisect_right(starts, pos) - 1
+    return origins[index] + pos - starts[index]
+
+
+class PositionIndex(object):
+    '''
+    find the tokens at an offset of the document, e.g. to sync the scroll of a
+    preview with an editor. tokens without a position are left out.
+        :params tokens: tokens parsed by a Scanner with ``positions`` set
+    '''
+    def __init__(self, tokens):
+        located = sorted(
+            (token for token in tokens if token.start >= 0),
+            key=lambda token: (token.start, -token.end))
+        self.tokens = located
+        self._starts = [token.start for token in located]
+        # index of the token each token is nested in, -1 for none
+        self._parents = []
+        stack = []
+        for index, token in enumerate(located):
+            while stack and located[stack[-1]].end <= token.start:
+                stack.pop()
+            self._parents.append(stack[-1] if stack else -1)
+            stack.append(index)
+
+    def tokens_at(self, offset):
+        '''
+        return the tokens whose source covers the offset, the innermost first
+        '''
+        found = []
+        index = bisect_right(self._starts, offset) - 1
+        while index >= 0:
+            token = self.tokens[index]
+            if token.end > offset:
+                found.append(token)
+            index = self._parents[index]
+        return found
+
+    def token_at(self, offset):
+        '''
+        return the innermost token whose source covers the offset, or None
+        '''
+        found = self.tokens_at(offset)
+        return found[0] if found else None
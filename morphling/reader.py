@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+'''
+read a markdown file as the source a Scanner parses, see ``Scanner.prepare``,
+without more than one full copy of the document in memory at a time.
+
+the file is mapped in memory. a utf-8 file that has nothing to normalize is
+decoded from the map at once. any other file is decoded and prepared a chunk of
+lines at a time, the newlines, tabs and special spaces of a chunk in one go, and
+the chunks are written to a temporary file in utf-8 that is mapped and decoded
+in turn. a file smaller than a chunk is read whole.
+'''
+import codecs
+import mmap
+import os
+import re
+import tempfile
+
+
+_chunk_size = 256 * 1024
+
+# what ``Scanner.prepare`` changes in a utf-8 file: line breaks other than newlines,
+# tabs, no-break spaces, the symbol for newline, and lines of spaces only. finding
+# each character on its own is much faster than a regex of all of them
+_unprepared = [character.encode('utf-8') for character in '\r\t\u00a0\u2424']
+_blank_line_regex = re.compile(br'\n +(?:\n|\Z)')
+_first_blank_line_regex = re.compile(br' +(?:\n|\Z)')
+
+
+def iter_prepared(pieces, prepare):
+    '''
+    prepare text read piece by piece as ``prepare`` does the whole text less its
+    last newlines: yield the prepared text of the lines as soon as they are complete
+        :params pieces: an iterable of strings
+        :params prepare: the ``prepare`` method of a Scanner
+    '''
+    raw = ''
+    for piece in pieces:
+        raw += piece
+        # the lines that are complete, and not followed by the last newlines of the
+        # text, which are removed before preparing it
+        text = raw.rstrip('\r\n')
+        end = max(text.rfind('\n'), text.rfind('\r')) + 1
+        if end:
+            yield prepare(raw[:end])
+            raw = raw[end:]
+    yield prepare(raw.rstrip('\n'))
+
+
+def read_prepared(path, prepare, encoding='utf-8'):
+    '''
+    return the content of a file prepared by ``prepare`` as ``Scanner.parse``
+    prepares a content
+        :params path: location of the file
+        :params prepare: the ``prepare`` method of a Scanner
+        :params encoding: encoding of the file
+    '''
+    utf8 = codecs.lookup(encoding).name == 'utf-8'
+    with open(path, 'rb') as f:
+        if utf8 and _is_prepared(f):
+            return _decode(f, strip=True)
+        size = os.fstat(f.fileno()).st_size
+    if size <= _chunk_size:
+        # the copies of a chunk would take more than the ones of the whole file
+        with open(path, encoding=encoding) as source:
+            return prepare(source.read().rstrip('\n'))
+    with open(path, encoding=encoding) as source, \
+            tempfile.TemporaryFile() as spool:
+        for text in iter_prepared(iter(lambda: source.read(_chunk_size), ''), prepare):
+            spool.write(text.encode('utf-8'))
+        spool.flush()
+        return _decode(spool, strip=False)
+
+
+def _map(f):
+    '''
+    return a read-only map of a file, None for an empty one
+    '''
+    if not os.fstat(f.fileno()).st_size:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _is_prepared(f):
+    mapped = _map(f)
+    if mapped is None:
+        return True
+    with mapped:
+        return not (
+            any(mapped.find(character) != -1 for character in _unprepared) or
+            _blank_line_regex.search(mapped) or _first_blank_line_regex.match(mapped))
+
+
+def _decode(f, strip):
+    '''
+    return the text of a utf-8 file, decoded from a map of it, less its last
+    newlines if ``strip``
+    '''
+    mapped = _map(f)
+    if mapped is None:
+        return ''
+    with mapped:
+        end = len(mapped)
+        while strip and end:
+            tail = mapped[max(end - 4096, 0):end]
+            end -= len(tail) - len(tail.rstrip(b'\n'))
+            if tail.rstrip(b'\n'):
+                break
+        with memoryview(mapped) as view, view[:end] as content:
+            return str(content, 'utf-8')
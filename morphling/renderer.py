@@ -5,16 +5,38 @@ import re
 class Renderer(object):
     '''
     the default renderer for parser
+        :params escape: escape the html in the content
+        :params tag_templates: keep the html of the tags without attributes once
+                               it is built, set it to False if the tag names, e.g.
+                               ``_p``, change after the renderer is created
     '''
     _escape_pattern = re.compile(r'&(?!#?\w+;)')
+    _blank_lines_pattern = re.compile(r'\n\s*\n')
     _not_allowed_schemes = ['javascript:', 'vbscript:']
 
     # HTML tags
     _p = 'p'
     _tr = 'tr'
 
+    # tags whose templates are built with the renderer, the others on first use
+    _templated_tags = (
+        'p', 'tr', 'th', 'td', 'em', 'strong', 'code', 'del', 'a', 'sup', 'li', 'ul', 'ol',
+        'blockquote', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    )
+    # tag -> '<tag >', and (tag, breakline) -> '</tag>', None to build the html each
+    # time, e.g. for a subclass whose __init__ does not call this one
+    _open_tags = None
+    _close_tags = None
+
     def __init__(self, **kwargs):
         self._escape = kwargs.get('escape', True)
+        if kwargs.get('tag_templates', True):
+            self._open_tags = {}
+            self._close_tags = {}
+            for tag in self._templated_tags:
+                self.open_tag(tag)
+                self.close_tag(tag)
+                self.close_tag(tag, breakline=True)
 
     @property
     def p(self):
@@ -40,15 +62,31 @@ class Renderer(object):
         return '<br>\n'
 
     def escape(self, content, quote=False, smart_amp=True):
-        if smart_amp:
-            content = self._escape_pattern.sub('&amp;', content)
-        else:
-            content = content.replace('&', '&amp;')
+        '''
+        escape &, < and >, and " and ' with ``quote``. with ``smart_amp`` the &
+        of entities like &amp; or &#39; are kept.
+        each replace is one scan in C that returns the same string when there is
+        nothing to replace, so a string without special characters is returned as is
+        '''
+        if '&' in content:
+            if smart_amp:
+                content = self._escape_pattern.sub('&amp;', content)
+            else:
+                content = content.replace('&', '&amp;')
         content = content.replace('<', '&lt;').replace('>', '&gt;')
         if quote:
             content = content.replace('"', '&quot;').replace("'", '&#39;')
         return content
 
+    def plain_text(self, content):
+        '''
+        paragraphs of escaped text, it is always escaped as it is used for sources
+        that could not be parsed
+        '''
+        return ''.join(
+            self.block_html('p', self.escape(paragraph, smart_amp=False))
+            for paragraph in self._blank_lines_pattern.split(content) if paragraph.strip())
+
     def escape_link(self, link):
         lower_url = link.lower().strip('\x00\x1a \n\r\t')
         for scheme in self._not_allowed_schemes:
@@ -57,23 +95,33 @@ class Renderer(object):
         return self.escape(link, quote=True, smart_amp=False)
 
     def open_tag(self, tag, **kwargs):
+        if not kwargs and self._open_tags is not None:
+            try:
+                return self._open_tags[tag]
+            except KeyError:
+                pass
         extras = ['%s=%s' % (k, v) for k, v in kwargs.items() if v]
-        tag = getattr(self, ''.join(['_', tag]), tag)
-        return '<{tag} {attrs}>'.format(tag=tag, attrs=' '.join(extras))
+        name = getattr(self, ''.join(['_', tag]), tag)
+        html = '<{tag} {attrs}>'.format(tag=name, attrs=' '.join(extras))
+        if not kwargs and self._open_tags is not None:
+            self._open_tags[tag] = html
+        return html
 
     def close_tag(self, tag, breakline=False):
-        tag = getattr(self, ''.join(['_', tag]), tag)
-        if breakline:
-            return '</%s>\n' % tag
-        return '</%s>' % tag
+        if self._close_tags is not None:
+            try:
+                return self._close_tags[tag, breakline]
+            except KeyError:
+                pass
+        name = getattr(self, ''.join(['_', tag]), tag)
+        html = '</%s>\n' % name if breakline else '</%s>' % name
+        if self._close_tags is not None:
+            self._close_tags[tag, breakline] = html
+        return html
 
     def block_html(self, tag, content, breakline=True, **kwargs):
-        fmt = '{open_t}{cnt}{close_t}'
-        return fmt.format(
-            open_t=self.open_tag(tag, **kwargs),
-            cnt=content,
-            close_t=self.close_tag(tag, breakline=breakline)
-        )
+        return '%s%s%s' % (
+            self.open_tag(tag, **kwargs), content, self.close_tag(tag, breakline=breakline))
 
     def tr(self, content, **kwargs):
         return self.block_html('tr', content, **kwargs)
@@ -1,13 +1,84 @@
 # coding: utf-8
 
 import re
+from bisect import bisect_right
 from itertools import chain
-from .token import blocks_default, list_items, block_footnotes, inlines_default, inline_htmls
+from .token import (
+    TokenBase, SourceIndex, blocks_default, list_items, block_footnotes, inlines_default,
+    inline_htmls, BlockFootnote)
+from .stats import timer
+from .limits import LimitExceeded
+from .grammar import Grammar
+from .positions import PositionIndex, line_starts, map_offset, source_map
+
+
+def _matches_at_offset(token_class):
+    '''
+    check whether ``token_class.match`` accepts the ``pos`` argument. Token classes
+    that override ``match`` with the old ``match(source, scanner)`` signature are
+    given slices of the source instead.
+    '''
+    func = getattr(token_class.match, '__func__', token_class.match)
+    code = getattr(func, '__code__', None)
+    return code is not None and 'pos' in code.co_varnames[:code.co_argcount]
+
+
+class _Frame(object):
+    '''
+    a source being parsed by the scanner, and where it is at
+    '''
+    __slots__ = (
+        'source', 'table', 'fallback', 'pos', 'depth', 'then', 'index', 'base', 'lines')
+
+    def __init__(self, source, table, fallback, depth, then=()):
+        self.source = source
+        self.table = table
+        self.fallback = fallback
+        self.pos = 0
+        self.depth = depth
+        self.then = then
+        self.index = None  # SourceIndex, see ``Scanner.source_index``
+        # where the source is in the document, see ``Scanner._place``: it starts at
+        # ``base``, or its offsets are mapped by ``lines``
+        self.base = 0
+        self.lines = None
+
+
+def _absolute(frame, pos):
+    '''
+    return the offset in the document of ``pos`` in the source of the frame
+    '''
+    if frame.lines is None:
+        return frame.base + pos
+    return map_offset(frame.lines, pos)
+
+
+def _map_segment(parent, pos, length, start, starts, origins):
+    '''
+    map ``length`` characters at ``pos`` of the source of the parent frame, which
+    are at ``start`` in the source of a frame: add to ``starts`` and ``origins``
+    where they are in the document, see ``morphling.positions.source_map``
+    '''
+    starts.append(start)
+    origins.append(_absolute(parent, pos))
+    if parent.lines is not None:
+        parent_starts, parent_origins = parent.lines
+        for index in range(bisect_right(parent_starts, pos), len(parent_starts)):
+            if parent_starts[index] >= pos + length:
+                break
+            starts.append(start + parent_starts[index] - pos)
+            origins.append(parent_origins[index])
 
 
 class Scanner(object):
     '''
     scanner to do the actual parsing job
+        :params stats: an instance of morphling.stats.ScannerStats to profile the
+                       token classes, profiling costs nothing when it is not set
+        :params limits: an instance of morphling.limits.Limits, ``parse`` raises
+                        morphling.limits.LimitExceeded when the source goes over them
+        :params positions: record where each token comes from in the document, see
+                           ``TokenBase.start`` and ``position_index``
     '''
     # default regex: parse default blocks
     default_regex = blocks_default
@@ -24,37 +95,354 @@ class Scanner(object):
     # inline_htmls: parse inline html elements
     inline_htmls = inline_htmls
 
-    def __init__(self):
+    _grammar_names = (
+        'default_regex', 'list_regex', 'footnote_regex', 'default_inline_regex', 'inline_htmls')
+
+    # token class -> whether its ``match`` takes an offset, see ``_matches_at_offset``
+    _offset_matchers = {}
+
+    # tuple of token classes -> Grammar, see ``grammar``
+    _grammars = {}
+
+    _newline_regex = re.compile(r'\r\n|\r')
+    # lines of spaces, see ``_clear_blank_lines``
+    _blank_line_regex = re.compile(r'\n +(?=\n|\Z)')
+    _first_blank_line_regex = re.compile(r' +(?=\n|\Z)')
+
+    def __init__(self, stats=None, limits=None, positions=False):
+        self.stats = stats
+        self.limits = limits
+        self.positions = positions
+        self._line_starts = None  # of the document, when positions are recorded
+        self._deadline = None
         self._tokens = []
         self._footnotes = []
         self._links = []
+        self._link_index = {}
+        self._stack = []  # frames of the sources being parsed, see ``parse``
+        self._pending = None  # contents nested by the token being set up
+        self._clear_footnotes()
 
-    def parse(self, source, regexs=None):
+    def spawn(self):
+        '''
+        return a new scanner with the same grammar as this one and its own
+        parsing state
+        '''
+        scanner = self.__class__(stats=self.stats, limits=self.limits, positions=self.positions)
+        for name in self._grammar_names:
+            # token lists set on this instance only
+            if name in self.__dict__:
+                setattr(scanner, name, self.__dict__[name])
+        return scanner
+
+    def parse(self, source, regexs=None, prepared=False):
         '''
         to parse(match) the source using the given regexs.
             :params source: the source text
             :params regexs: regex used to match the source
+            :params prepared: the source was already prepared, see ``prepare``, e.g. by
+                              morphling.reader. positions are then offsets in it
         it iterates the regexs and calls the token's `match` method to
-        try to match the source. Once matched, the token will create a
-        new instance of itself and add it to the token collection of the
-        scanner.
+        try to match the source at the current position. Once matched, the
+        token will create a new instance of itself and add it to the token
+        collection of the scanner, and the position moves past the matched
+        content.
+        tokens parse the content they nest with ``parse_nested``, which keeps a stack
+        of frames instead of recursing, so the depth of nesting is only bounded by
+        memory. Calling ``parse`` from ``setup`` still works, it parses the content
+        right away.
         '''
-        source = self.prepare(source.rstrip('\n'))
-        regexs = regexs or self.default_regex
+        if self.limits is not None:
+            self._enter_limits(source)
+        stack = self._stack
+        document = None
+        if stack:
+            # called from the setup of a token, on a part of the source
+            source = self.prepare_fragment(source)
+        else:
+            document = source
+            if not prepared:
+                source = self.prepare(source.rstrip('\n'))
+        base = len(stack)
+        depth = stack[-1].depth + 1 if stack else 0
+        pending, self._pending = self._pending, []
+        try:
+            self._push(source, regexs, depth)
+            if self.positions:
+                if document is not None:
+                    self._line_starts = line_starts(document)
+                    stack[-1].lines = source_map(document, source)
+                else:
+                    # the frame the token is matched in is at its start
+                    self._place(stack[-1], stack[-2], stack[-2].pos)
+            self._run(base)
+        finally:
+            del stack[base:]
+            self._pending = pending
+        return self._tokens
 
-        while source:
-            match = None
-            for token_class in regexs:
-                match = token_class.match(source, scanner=self)
+    def iter_blocks(self, source, pos=0, regexs=None):
+        '''
+        parse a prepared source one top-level token at a time, from ``pos``: yield
+        the position after each token, once the content it nests is parsed too.
+        the tokens are added to the scanner as ``parse`` does, the caller may stop
+        iterating at any time.
+            :params source: the source text, already prepared
+            :params pos: where to start, the start of a top-level token
+            :params regexs: regex used to match the source
+        '''
+        stack = self._stack
+        base = len(stack)
+        pending, self._pending = self._pending, []
+        try:
+            self._push(source, regexs, 0)
+            frame = stack[-1]
+            frame.pos = pos
+            if self.positions:
+                self._line_starts = line_starts(source)
+            end = len(source)
+            while frame.pos < end:
+                self._run(base, once=True)
+                yield frame.pos
+        finally:
+            del stack[base:]
+            self._pending = pending
+
+    def parse_nested(self, source, regexs=None, then=(), offset=None):
+        '''
+        parse the content of the token being set up, one level deeper. the content
+        is parsed once ``setup`` returns, before the rest of the source, so what
+        follows the content goes to ``then``.
+            :params source: the content, taken from a source that was prepared
+            :params regexs: regex used to match the content
+            :params then: tokens to add, or functions to call without arguments, once
+                          the content is parsed
+            :params offset: where the content starts from the start of the token, to
+                            record the positions of its tokens. when it is not given
+                            the content is looked for in the source of the token
+        '''
+        if self._pending is None:
+            # not called from the setup of a token matched by ``parse``
+            self.parse(source, regexs)
+            self._run_steps(then)
+            return
+        self._pending.append((self.prepare_fragment(source), regexs, then, offset))
+
+    def _push(self, source, regexs, depth, then=()):
+        if self.limits is not None:
+            self.limits.check('max_depth', depth)
+        grammar = self.grammar(regexs or self.default_regex)
+        if self.stats is None:
+            table, fallback = grammar.combined_table, grammar.combined_fallback
+        else:
+            # profile each token class on its own
+            table, fallback = grammar.table, grammar.fallback
+        self._stack.append(_Frame(source, table, fallback, depth, then))
+
+    def _run(self, base, once=False):
+        '''
+        match tokens in the frame on top of the stack until there are ``base``
+        frames left. a frame is left when a token nests contents, which are pushed
+        above it, and resumed once they are parsed.
+        with ``once``, return as soon as the frame at ``base`` has matched one token
+        and what it nests is parsed, see ``iter_blocks``.
+        '''
+        stack = self._stack
+        pending = self._pending
+        limits = self.limits
+        positions = self.positions
+        match_token = self.match_token if self.stats is None else self._profile_match_token
+        bottom = stack[base] if once else None
+        first = bottom.pos if once else None
+        while len(stack) > base:
+            frame = stack[-1]
+            if frame is bottom and frame.pos != first:
+                return
+            source = frame.source
+            table = frame.table
+            fallback = frame.fallback
+            pos = frame.pos
+            end = len(source)
+            while pos < end:
+                if positions:
+                    # for ``parse`` called from the setup of the token
+                    frame.pos = pos
+                match = None
+                for token_class in table.get(source[pos], fallback):
+                    match = match_token(token_class, source, pos)
+                    if match:
+                        break
                 if match:
+                    # self._tokens.append(match) Token implements this function
+                    if positions:
+                        self._locate(match, frame, pos)
+                    start = pos
+                    pos += match.length
+                else:
+                    raise RuntimeError('Not match any token')
+                if limits is not None:
+                    self._check_limits()
+                if pending or frame is bottom:
+                    break
+            frame.pos = pos
+            if pending:
+                # the first content ends up on top
+                for content, regexs, then, offset in reversed(pending):
+                    self._push(content, regexs, frame.depth + 1, then)
+                    if positions:
+                        self._place(stack[-1], frame, start, offset)
+                del pending[:]
+                continue
+            if pos < end:
+                # stopped after one token of the bottom frame
+                continue
+            stack.pop()
+            self._run_steps(frame.then)
+
+    def _locate(self, token, frame, pos):
+        '''
+        record where the token matched at ``pos`` of the frame is in the document
+        '''
+        start = _absolute(frame, pos)
+        length = token.length
+        token.start = start
+        token.end = _absolute(frame, pos + length - 1) + 1 if length else start
+        line = bisect_right(self._line_starts, start)
+        token.lineno = line
+        token.column = start - self._line_starts[line - 1]
+
+    def _place(self, frame, parent, pos, offset=None):
+        '''
+        find where the source of a frame is in the document, from the frame of the
+        token that nests it, matched at ``pos``
+        '''
+        content = frame.source
+        outer = parent.source
+        if offset is None:
+            found = outer.find(content, pos)
+            origin = pos if found == -1 else found
+        else:
+            origin = pos + offset
+        if parent.lines is None and outer.startswith(content, origin):
+            frame.base = parent.base + origin
+            return
+        starts = []
+        origins = []
+        if outer.startswith(content, origin):
+            _map_segment(parent, origin, len(content), 0, starts, origins)
+        else:
+            # the lines lost their marks, e.g. of a block quote or a list item: each
+            # one ends where its line in the source of the parent ends
+            start = 0
+            line_end = outer.find('\n', origin)
+            for line in content.split('\n'):
+                end = len(outer) if line_end == -1 else line_end
+                _map_segment(parent, end - len(line), len(line), start, starts, origins)
+                if line_end == -1:
                     break
-            if match:
-                # self._tokens.append(match) Token implements this function
-                source = source[match.length:]
+                start += len(line) + 1
+                line_end = outer.find('\n', line_end + 1)
+        frame.lines = starts, origins
+
+    def position_index(self):
+        '''
+        return a morphling.positions.PositionIndex of the tokens parsed, when the
+        scanner records positions
+        '''
+        return PositionIndex(chain(self._tokens, self._footnotes, self._links))
+
+    def _run_steps(self, steps):
+        for step in steps:
+            if isinstance(step, TokenBase):
+                self.add_token(step)
             else:
-                raise RuntimeError('Not match any token')
+                step()
 
-        return self._tokens
+    def _enter_limits(self, source):
+        '''
+        check the limits known before parsing the source, and start the clock of
+        the document on the outermost call
+        '''
+        limits = self.limits
+        if not self._stack:
+            limits.check('max_size', len(source))
+            if limits.max_seconds is not None:
+                self._deadline = timer() + limits.max_seconds
+        self._check_limits()
+
+    def _check_limits(self):
+        '''
+        check the limits that grow while parsing: the number of tokens and the time
+        '''
+        limits = self.limits
+        if limits.max_tokens is not None:
+            limits.check(
+                'max_tokens', len(self._tokens) + len(self._footnotes) + len(self._links))
+        if self._deadline is not None:
+            late = timer() - self._deadline
+            if late > 0:
+                raise LimitExceeded(
+                    'max_seconds', limits.max_seconds + late, limits.max_seconds)
+
+    def source_index(self, source):
+        '''
+        return the SourceIndex of the source being parsed, built on first use and
+        shared by the tokens matched on it while its frame is on the stack
+        '''
+        if self._stack and self._stack[-1].source is source:
+            frame = self._stack[-1]
+            if frame.index is None:
+                frame.index = SourceIndex(source)
+            return frame.index
+        return SourceIndex(source)
+
+    @classmethod
+    def grammar(cls, regexs):
+        '''
+        return the Grammar of the token classes, compiled on first use. A list of
+        token classes that changes, e.g. with ``TokenBase.add_to_scanner``, or with
+        a class whose ``regex`` or ``leading_chars`` is set again, is compiled again.
+        '''
+        key = tuple(regexs)
+        grammar = cls._grammars.get(key)
+        if grammar is None or not grammar.is_current():
+            grammar = cls._grammars[key] = Grammar(key)
+        return grammar
+
+    @classmethod
+    def dispatch_table(cls, regexs):
+        '''
+        index the token classes by the characters they can start with.
+        return a dict of first character -> token classes to try, and the token
+        classes to try for any other character. Both keep the order of ``regexs``.
+        '''
+        grammar = cls.grammar(regexs)
+        return grammar.table, grammar.fallback
+
+    def match_token(self, token_class, source, pos):
+        '''
+        try to match ``token_class`` at offset ``pos`` of the source
+        '''
+        try:
+            at_offset = self._offset_matchers[token_class]
+        except KeyError:
+            at_offset = self._offset_matchers[token_class] = _matches_at_offset(token_class)
+        if at_offset:
+            return token_class.match(source, scanner=self, pos=pos)
+        return token_class.match(source[pos:], scanner=self)
+
+    def _profile_match_token(self, token_class, source, pos):
+        '''
+        ``match_token`` that records the time spent in it less the one of the
+        ``setup`` of the token, which the token records, see ``TokenBase.__init__``
+        '''
+        stats = self.stats.get(token_class)
+        setup_time = stats.setup_time
+        start = timer()
+        token = self.match_token(token_class, source, pos)
+        elapsed = timer() - start
+        self.stats.record_match(token_class, token, elapsed - (stats.setup_time - setup_time))
+        return token
 
     @property
     def links(self):
@@ -74,8 +462,88 @@ class Scanner(object):
     def add_footnote(self, footnote):
         self._footnotes.append(footnote)
 
+    def open_footnote(self, footnote):
+        '''
+        add the head token of a footnote definition, remember where its block
+        starts for ``move_block_to_footnotes`` and index it by its key
+        '''
+        self._footnote_starts.append(len(self._tokens))
+        self._footnote_index[footnote.key] = footnote
+        self.add_token(footnote)
+
+    def get_footnote(self, key):
+        '''
+        return the footnote definition of the (normalized) key, or None
+        '''
+        return self._footnote_index.get(key)
+
+    def count_footnote_ref(self):
+        '''
+        return the number of a new footnote reference
+        '''
+        self._footnote_refs += 1
+        return self._footnote_refs
+
     def add_link(self, link):
         self._links.append(link)
+        # the last definition of a key wins
+        self._link_index[link.ref_key] = link
+
+    def get_link(self, ref_key):
+        '''
+        return the link definition of the (normalized) ref_key, or None
+        '''
+        return self._link_index.get(ref_key)
+
+    @property
+    def footnote_refs(self):
+        '''
+        the number of footnote references so far, set it to number the ones of a
+        source parsed from partway through
+        '''
+        return self._footnote_refs
+
+    @footnote_refs.setter
+    def footnote_refs(self, count):
+        self._footnote_refs = count
+
+    def take_parsed(self):
+        '''
+        return the tokens, footnotes and links parsed so far and start new lists for
+        the next ones, e.g. to keep them by top-level block along ``iter_blocks``.
+        their definitions stay indexed
+        '''
+        parsed = self._tokens, self._footnotes, self._links
+        self._tokens, self._footnotes, self._links = [], [], []
+        return parsed
+
+    def set_parsed(self, tokens, footnotes, links, refs):
+        '''
+        set the tokens, footnotes and links of a source parsed in parts, with the
+        number of footnote references among them, and index their definitions
+        '''
+        self._tokens, self._footnotes, self._links = tokens, footnotes, links
+        self._footnote_refs = refs
+        self.reindex(links, footnotes)
+
+    def index_definitions(self, links, footnotes):
+        '''
+        index the link definitions and the heads of the footnote definitions among
+        ``footnotes``, the last one of a key wins as in ``add_link``
+        '''
+        for link in links:
+            self._link_index[link.ref_key] = link
+        for token in footnotes:
+            if isinstance(token, BlockFootnote) and token.is_head:
+                self._footnote_index[token.key] = token
+
+    def reindex(self, links, footnotes):
+        '''
+        index these definitions instead of the ones indexed, see ``index_definitions``
+        '''
+        self._link_index = {}
+        self._footnote_index = {}
+        self.index_definitions(links, footnotes)
 
     @property
     def all_tokens(self):
@@ -86,6 +554,12 @@ class Scanner(object):
         '''
         move the last block to footnote
         '''
+        if self._footnote_starts:
+            index = self._footnote_starts.pop()
+            self._footnotes.extend(self._tokens[index:])
+            self._tokens[index:] = []
+            return
+        # the block was not opened by ``open_footnote``, look for its head
         index = -1
         try:
             while not (
@@ -101,13 +575,44 @@ class Scanner(object):
         '''
         do some preparation before parsing
         '''
-        newline = re.compile(r'\r\n|\r')
-        spaces = re.compile(r'^ +$', re.M)
-        procceed = newline.sub('\n', source).expandtabs(4).replace(
-            '\u00a0', ' ').replace('\u2424', '\n')
-        return spaces.sub('', procceed)
+        procceed = self._newline_regex.sub('\n', source)
+        if '\t' in procceed:
+            procceed = procceed.expandtabs(4)
+        procceed = procceed.replace('\u00a0', ' ').replace('\u2424', '\n')
+        return self._clear_blank_lines(procceed)
+
+    def prepare_fragment(self, source):
+        '''
+        prepare a part of a source that was prepared: its newlines, tabs and spaces
+        are already normalized, but lines may have been left with only spaces
+        e.g. by removing the marks of a block quote
+        '''
+        source = source.rstrip('\n')
+        # a line of spaces ends with a space
+        if ' \n' in source or source.endswith(' '):
+            source = self._clear_blank_lines(source)
+        return source
+
+    def _clear_blank_lines(self, source):
+        '''
+        empty the lines made of spaces only. a pattern that starts with a newline is
+        searched much faster than one that starts with ``^``
+        '''
+        source = self._blank_line_regex.sub('\n', source)
+        blank = self._first_blank_line_regex.match(source)
+        if blank:
+            source = source[blank.end():]
+        return source
 
     def clear(self):
+        self._deadline = None
         self._tokens = []
         self._links = []
+        self._link_index = {}
         self._footnotes = []
+        self._clear_footnotes()
+
+    def _clear_footnotes(self):
+        self._footnote_index = {}
+        self._footnote_starts = []
+        self._footnote_refs = 0
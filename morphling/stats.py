@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+'''
+per token class statistics collected by a Scanner created with ``stats=ScannerStats()``
+'''
+from timeit import default_timer as timer  # noqa
+
+
+class TokenStats(object):
+    '''
+    counters of one token class. times are in seconds. ``setup_time`` covers the
+    ``setup`` of the tokens, the content they nest is parsed afterwards and counted
+    for the token classes it is made of. ``match_time`` covers ``match`` less that.
+    '''
+    def __init__(self, token_class):
+        self.token_class = token_class
+        self.attempts = 0
+        self.matches = 0
+        self.match_time = 0.0
+        self.setup_time = 0.0
+        self.renders = 0
+        self.render_time = 0.0
+
+    @property
+    def name(self):
+        return self.token_class.__name__
+
+    @property
+    def total_time(self):
+        return self.match_time + self.setup_time + self.render_time
+
+
+class ScannerStats(object):
+    '''
+    collect the number of match attempts and matches and the time spent in
+    ``match``, ``setup`` and ``as_html`` for each token class.
+    '''
+    def __init__(self):
+        self.tokens = {}
+
+    def get(self, token_class):
+        '''
+        return the TokenStats of token_class
+        '''
+        try:
+            return self.tokens[token_class]
+        except KeyError:
+            stats = self.tokens[token_class] = TokenStats(token_class)
+            return stats
+
+    def record_match(self, token_class, matched, match_time):
+        stats = self.get(token_class)
+        stats.attempts += 1
+        stats.match_time += match_time
+        if matched:
+            stats.matches += 1
+
+    def record_setup(self, token_class, setup_time):
+        self.get(token_class).setup_time += setup_time
+
+    def record_render(self, token_class, render_time):
+        stats = self.get(token_class)
+        stats.renders += 1
+        stats.render_time += render_time
+
+    def reset(self):
+        self.tokens = {}
+
+    def table(self):
+        '''
+        return the statistics as a text table, the slowest token classes first
+        '''
+        lines = ['{0:<16} {1:>9} {2:>9} {3:>11} {4:>11} {5:>11}'.format(
+            'token', 'attempts', 'matches', 'match (s)', 'setup (s)', 'render (s)')]
+        for stats in sorted(self.tokens.values(), key=lambda s: s.total_time, reverse=True):
+            lines.append('{0:<16} {1:>9} {2:>9} {3:>11.4f} {4:>11.4f} {5:>11.4f}'.format(
+                stats.name, stats.attempts, stats.matches,
+                stats.match_time, stats.setup_time, stats.render_time))
+        return '\n'.join(lines)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+'''
+render a markdown document read piece by piece, e.g. from a file too large to
+keep in memory, made by ``MarkdownParser.render_stream``.
+
+the text read so far is parsed one top-level token at a time and the html of the
+tokens that what is still to come can not change goes out at once, as a document
+edited at its end would keep them, see morphling.incremental. the tokens whose
+html depends on definitions that may come further down, reference links and
+footnote references, are written as placeholders and kept in a spool file. once
+the whole document is read, a last pass copies the html and fills the
+placeholders in from the definitions, the only thing kept from all the document.
+footnotes go to a spool of their own, they are written after everything else.
+'''
+import pickle
+import re
+import tempfile
+from bisect import bisect_right
+
+from morphling.incremental import _far_reaching, _lookbehind_lines
+from morphling.reader import iter_prepared
+
+
+_read_size = 64 * 1024
+
+# a placeholder, and a nul character of the html, see ``_fill``
+_placeholder = '\x00\x01'
+_mark_regex = re.compile('\x00(.)', re.S)
+
+
+class StreamRenderer(object):
+    '''
+    render markdown read piece by piece, keeping in memory the top-level blocks
+    that may still change and the link and footnote definitions.
+    a block that may change with what comes after it however far, e.g. a fence
+    that is not closed yet, is kept until the end of the document, or until
+    ``lookahead`` characters are kept: a document whose blocks reach further may
+    be rendered differently from ``MarkdownParser.render``. positions are not
+    recorded and limits are not checked.
+        :params scanner: a scanner of its own, see ``Scanner.spawn``
+        :params renderer: an instance of morphling.renderer.Renderer
+        :params lookahead: how many characters to keep for a block that reaches far
+    '''
+    def __init__(self, scanner, renderer, lookahead=1024 * 1024):
+        self.scanner = scanner
+        self.renderer = renderer
+        self.lookahead = lookahead
+        scanner.positions = False
+        scanner.limits = None
+
+    def render(self, source, stream):
+        '''
+        render the markdown and write the html to the stream
+            :params source: a file object open for reading text, or an iterable of
+                            strings
+            :params stream: file-like object with a ``write`` method
+        '''
+        scanner = self.scanner
+        scanner.clear()
+        # the definitions of the blocks written, the scanner's own indexes also
+        # have those of the blocks parsed again later
+        self._table = scanner.spawn()
+        self._stream = self._html = stream
+        self._refs = None  # spool of the tokens of the placeholders of ``_html``
+        self._footnotes_html = self._footnote_refs = None
+        self._buffer = ''
+        self._footnote_count = 0
+        self._next_parse = 0
+        if hasattr(source, 'read'):
+            pieces = iter(lambda: source.read(_read_size), '')
+        else:
+            pieces = source
+        try:
+            self._read(pieces)
+            if self._refs is not None:
+                _fill(self._html, self._refs, self._table, self.renderer, stream)
+            if self._footnotes_html is not None:
+                _fill(self._footnotes_html, self._footnote_refs, self._table, self.renderer,
+                      stream)
+        finally:
+            for spool in (self._refs, self._footnotes_html, self._footnote_refs):
+                if spool is not None:
+                    spool.close()
+            if self._html is not stream:
+                self._html.close()
+            self._stream = self._html = self._buffer = self._table = None
+
+    def _read(self, pieces):
+        for text in iter_prepared(pieces, self.scanner.prepare):
+            self._buffer += text
+            if len(self._buffer) >= self._next_parse:
+                self._parse(False)
+        self._parse(True)
+
+    def _parse(self, last):
+        '''
+        parse the buffer and write the top-level blocks that stay as they are
+        whatever comes after the buffer, all of them for the ``last`` one
+        '''
+        source = self._buffer
+        scanner = self.scanner
+        scanner.clear()
+        scanner.footnote_refs = self._footnote_count
+        blocks = []
+        pos = 0
+        for end in scanner.iter_blocks(source):
+            tokens, footnotes, links = scanner.take_parsed()
+            blocks.append((pos, tokens, footnotes, links, scanner.footnote_refs))
+            pos = end
+        if last:
+            kept = len(blocks)
+        else:
+            # as an edit at the end of the buffer, see ``Document.edit``
+            line = len(source)
+            for _ in range(_lookbehind_lines):
+                line = max(source.rfind('\n', 0, line), 0)
+            kept = max(bisect_right([block[0] for block in blocks], line) - 2, 0)
+            if len(source) <= self.lookahead:
+                for index in range(kept):
+                    start, tokens, footnotes, links, _ = blocks[index]
+                    end = blocks[index + 1][0]
+                    if _far_reaching(source, start, end, tokens, footnotes, links):
+                        kept = index
+                        break
+        # the html of the tokens has no nul character unless the source has one
+        nul = '\x00' in source
+        for _, tokens, footnotes, links, _ in blocks[:kept]:
+            if tokens:
+                self._write(tokens, nul, False)
+            if footnotes:
+                self._write(footnotes, nul, True)
+            self._table.index_definitions(links, footnotes)
+        if kept:
+            self._footnote_count = blocks[kept - 1][4]
+        self._buffer = source[blocks[kept][0]:] if kept < len(blocks) else ''
+        # parse the blocks kept again once the buffer doubled, not at each piece
+        self._next_parse = 2 * len(self._buffer)
+
+    def _write(self, tokens, nul, footnotes):
+        renderer = self.renderer
+        chunks = []
+        refs = None
+        # the nul characters of html that goes to a spool are written twice
+        spooled = nul and (footnotes or self._html is not self._stream)
+        for token in tokens:
+            if token.reads_definitions:
+                if refs is None:
+                    refs = self._spool(footnotes)
+                    if nul and not spooled:
+                        chunks = [html.replace('\x00', '\x00\x00') for html in chunks]
+                        spooled = True
+                token.scanner = None
+                pickle.dump(token, refs, pickle.HIGHEST_PROTOCOL)
+                chunks.append(_placeholder)
+                continue
+            html = token.as_html(renderer)
+            if spooled and '\x00' in html:
+                html = html.replace('\x00', '\x00\x00')
+            chunks.append(html)
+        if footnotes:
+            if self._footnotes_html is None:
+                self._footnotes_html = _text_spool()
+            self._footnotes_html.write(''.join(chunks))
+        else:
+            self._html.write(''.join(chunks))
+
+    def _spool(self, footnotes):
+        '''
+        return the spool of the tokens of the placeholders, once the html that may
+        have some goes to a spool too
+        '''
+        if footnotes:
+            if self._footnote_refs is None:
+                self._footnote_refs = tempfile.TemporaryFile()
+            return self._footnote_refs
+        if self._refs is None:
+            self._refs = tempfile.TemporaryFile()
+            self._html = _text_spool()
+        return self._refs
+
+
+def _text_spool():
+    return tempfile.TemporaryFile('w+', encoding='utf-8', newline='')
+
+
+def _fill(html, refs, scanner, renderer, stream):
+    '''
+    copy the html of a spool to the stream, rendering the token of each placeholder
+    with the definitions of the scanner. a nul character of the html is written
+    twice in the spool, so that it can be told from a placeholder.
+    '''
+    html.seek(0)
+    if refs is not None:
+        refs.seek(0)
+
+    def replace(match):
+        if match.group(1) == '\x00':
+            return '\x00'
+        token = pickle.load(refs)
+        token.scanner = scanner
+        return token.as_html(renderer)
+
+    carry = ''
+    while True:
+        chunk = html.read(_read_size)
+        if not chunk:
+            break
+        chunk = carry + chunk
+        # a mark cut in two by the chunk, when a run of nul characters is odd
+        nuls = len(chunk) - len(chunk.rstrip('\x00'))
+        if nuls % 2:
+            chunk, carry = chunk[:-1], '\x00'
+        else:
+            carry = ''
+        if '\x00' in chunk:
+            chunk = _mark_regex.sub(replace, chunk)
+        stream.write(chunk)
@@ -1,6 +1,11 @@
 # coding: utf-8
 
 import re
+from bisect import bisect_left
+from functools import partial
+
+from morphling.renderer import Renderer
+from morphling.stats import timer
 
 
 _inline_tags = [
@@ -14,6 +19,97 @@ _valid_attr = r'''\s*[a-zA-Z\-](?:\=(?:"[^"]*"|'[^']*'|\d+))*'''
 _block_tag = r'(?!(?:%s)\b)\w+%s' % ('|'.join(_inline_tags), _valid_end)
 
 
+def _unanchor(pattern):
+    '''
+    strip the '^' anchors that lead the top-level alternatives of ``pattern``, so
+    the compiled result can be matched at any offset with ``regex.match(source, pos)``.
+    A ``^\\b`` is rewritten as ``(?=\\w)``, which is what it means at the start of
+    a string.
+    '''
+    output = []
+    depth = 0
+    in_class = False
+    at_start = True
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if at_start and char == '^':
+            index += 1
+            if pattern.startswith('\\b', index):
+                output.append('(?=\\w)')
+                index += 2
+            at_start = False
+            continue
+        at_start = False
+        if char == '\\':
+            output.append(pattern[index:index + 2])
+            index += 2
+            continue
+        if in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+            # a ']' right after '[' or '[^' is a literal
+            if pattern.startswith(']', index + 1):
+                output.append('[')
+                index += 1
+                char = ']'
+            elif pattern.startswith('^]', index + 1):
+                output.append('[^')
+                index += 2
+                char = ']'
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            at_start = True
+        output.append(char)
+        index += 1
+    return ''.join(output)
+
+
+# width -> regex of up to that many spaces at the start of the lines, see ``_indent_regex``
+_indent_regexes = {}
+_indent_regexes_size = 64
+
+
+def _indent_regex(width):
+    '''
+    return the regex stripping up to ``width`` spaces of indent from each line. it is
+    compiled once for the widths up to ``_indent_regexes_size``
+    '''
+    try:
+        return _indent_regexes[width]
+    except KeyError:
+        pass
+    regex = re.compile(r'^ {1,%d}' % width, flags=re.M)
+    if width <= _indent_regexes_size:
+        _indent_regexes[width] = regex
+    return regex
+
+
+def source_index(source, scanner=None):
+    '''
+    return the SourceIndex of the source, shared by the tokens matched on it
+    '''
+    if scanner is None:
+        return SourceIndex(source)
+    return scanner.source_index(source)
+
+
+def _bracket_closed(source, scanner, pos):
+    '''
+    check whether the [ at ``pos``, or after a ! there, is closed, see
+    ``SourceIndex.bracket_end``
+    '''
+    if source.startswith('!', pos):
+        pos += 1
+    if not source.startswith('[', pos):
+        return False
+    return source_index(source, scanner).bracket_end(pos) != -1
+
+
 class TokenBase(object):
     '''
     TokenBase is the base class of all token classes, each token class has attribute
@@ -21,22 +117,57 @@ class TokenBase(object):
      matched, a new instance of that class will be created.
         :param matchs: match result of the compiled pattern
         :param scanner: instance of Scanner
+    A token keeps ``matchs`` unless its class sets ``retain_match`` to False: the token
+    classes of morphling take what they need from it in ``setup`` and drop it, as the
+    match object keeps the whole source string alive. A subclass of them defined
+    elsewhere keeps it again, as it may read ``self.matchs`` after ``setup``, unless
+    it sets ``retain_match`` itself.
+    ``leading_chars`` lets the scanner skip the token class at positions it can not
+    match. It only holds for the ``regex`` of the class that declares it: a subclass
+    that replaces the regex is tried everywhere unless it declares its own.
+    Token classes whose html depends on the link or footnote definitions of the
+    document set ``reads_definitions``.
+    A scanner created with ``positions=True`` sets ``start`` and ``end``, the offsets
+    of the matched content in the document, and ``lineno`` and ``column`` where it
+    starts, counted from 1 and 0. They are -1 on the tokens that were not matched,
+    e.g. those that close a block.
     '''
     _blank_regex = re.compile(r'\s+')
     regex = None
+    _offset_regex = None  # (regex, unanchored copy of regex), see ``offset_regex``
+    retain_match = True
+    # characters the matched content can start with, None if it can start with any
+    leading_chars = None
+    reads_definitions = False
+    start = end = lineno = column = -1
+
+    def __init_subclass__(cls, **kwargs):
+        super(TokenBase, cls).__init_subclass__(**kwargs)
+        if cls.__module__ != __name__ and 'retain_match' not in cls.__dict__:
+            cls.retain_match = True
 
     def __init__(self, matchs=None, scanner=None):
         self.matchs = matchs
         self.scanner = scanner
+        self._length = matchs.end() - matchs.start() if matchs else 0
         if not scanner:
             return
         if matchs:
-            self.setup()
+            if scanner.stats is None:
+                self.setup()
+            else:
+                start = timer()
+                self.setup()
+                scanner.stats.record_setup(self.__class__, timer() - start)
+            if not self.retain_match:
+                self.matchs = None
 
     def _clone(self):
         obj = self.__class__()
         for k, v in self.__dict__.items():
             obj.__dict__[k] = v
+        if not self.retain_match:
+            obj.matchs = None
         return obj
 
     @classmethod
@@ -61,23 +192,34 @@ class TokenBase(object):
             ptn = ptn[1:]
         return ptn
 
+    @classmethod
+    def offset_regex(cls):
+        '''
+        return ``cls.regex`` without its leading '^' anchors, so that it can be
+        matched at an offset of the source instead of a slice of it
+        '''
+        cached = cls.__dict__.get('_offset_regex')
+        if cached is None or cached[0] is not cls.regex:
+            cached = (cls.regex, re.compile(_unanchor(cls.regex.pattern), cls.regex.flags))
+            cls._offset_regex = cached
+        return cached[1]
+
     @property
     def length(self):
         '''
         the length of the matched content
         '''
-        if not self.matchs:
-            return 0
-        return len(self.matchs.group(0))
+        return self._length
 
     @classmethod
-    def match(cls, source, scanner=None):
+    def match(cls, source, scanner=None, pos=0):
         '''
         try to match the given source with cls's pattern
         :param source: source to match
         :param scanner: instance of a Scanner class
+        :param pos: offset of the source where the match starts
         '''
-        match = cls.regex.match(source)
+        match = cls.offset_regex().match(source, pos)
         if not match:
             return None
         new_token = cls(match, scanner=scanner)
@@ -99,6 +241,22 @@ class TokenBase(object):
         '''
         raise NotImplementedError()
 
+    def _parse_content(self, regexs, offset=None):
+        '''
+        parse ``self.content`` after the token, then close it with a copy of the
+        token whose ``is_head`` is False
+            :params offset: where the content starts from the start of the token
+        '''
+        tail = self._clone()
+        tail.is_head = False
+        self.scanner.parse_nested(self.content, regexs, then=(tail,), offset=offset)
+
+    def _offset(self, group):
+        '''
+        return where a group of the match starts from the start of the token
+        '''
+        return self.matchs.start(group) - self.matchs.start()
+
     def _shrink_blank_characters(self, s):
         '''
         lower the given string and shrink its blank continuous characters into 1 space
@@ -121,6 +279,8 @@ class BlockLink(TokenBase):
         r'<?([^\s>]+)>?'  # <link> or link
         r'(?: +["(]([^\n]+)[")])? *(?:\n+|$)'
     )
+    leading_chars = ' ['
+    retain_match = False
 
     def setup(self):
         self._refkey = self._shrink_blank_characters(self.matchs.group(1))
@@ -138,17 +298,20 @@ class BlockLink(TokenBase):
 
 class BlockFootnote(TokenBase):
     regex = re.compile(r'(\ ?\ ?\ ?)\[\^([^\]]*)\]:\s*(.*)')
+    leading_chars = ' ['
+    retain_match = False
 
     def setup(self):
         self.is_head = True
         self.key = self._shrink_blank_characters(self.matchs.group(2) or self.matchs.group(1))
         self.description = self.matchs.group(3)
-        self.scanner.add_token(self)
-        self.scanner.parse(self.description, self.scanner.default_inline_regex)
+        self.scanner.open_footnote(self)
         tail = self._clone()
         tail.is_head = False
-        self.scanner.add_token(tail)
-        self.scanner.move_block_to_footnotes(self.__class__)
+        self.scanner.parse_nested(
+            self.description, self.scanner.default_inline_regex,
+            then=(tail, partial(self.scanner.move_block_to_footnotes, self.__class__)),
+            offset=self._offset(3))
 
     def as_html(self, renderer):
         if self.is_head:
@@ -158,6 +321,8 @@ class BlockFootnote(TokenBase):
 
 class NewLine(TokenBase):
     regex = re.compile(r'^\n+')
+    leading_chars = '\n'
+    retain_match = False
 
     def setup(self):
         if self.length > 1:
@@ -169,6 +334,8 @@ class NewLine(TokenBase):
 
 class BlockCode(TokenBase):
     regex = re.compile(r'^( {4}[^\n]+\n*)+')
+    leading_chars = ' '
+    retain_match = False
     _leading_pattern = re.compile(r'^ {4}', re.M)
 
     def setup(self):
@@ -185,6 +352,14 @@ class Fence(TokenBase):
         r'([\s\S]+?)\s*'
         r'\1 *(?:\n+|$)'  # ```
     )
+    leading_chars = ' `~'
+    retain_match = False
+
+    @classmethod
+    def match(cls, source, scanner=None, pos=0):
+        if cls.regex is Fence.regex and not source_index(source, scanner).fence_may_close(pos):
+            return None
+        return super(Fence, cls).match(source, scanner, pos)
 
     def setup(self):
         self.language = self.matchs.group(2)
@@ -197,6 +372,8 @@ class Fence(TokenBase):
 
 class Hrule(TokenBase):
     regex = re.compile(r'^ {0,3}[-*_](?: *[-*_]){2,} *(?:\n+|$)')
+    leading_chars = ' -*_'
+    retain_match = False
 
     def as_html(self, renderer):
         return renderer.hr
@@ -204,16 +381,15 @@ class Hrule(TokenBase):
 
 class Heading(TokenBase):
     regex = re.compile(r'^ *(#{1,6}) *([^\n]+?) *#* *(?:\n+|$)')
+    leading_chars = ' #'
+    retain_match = False
 
     def setup(self):
         self.is_head = True
         self.heading_level = len(self.matchs.group(1))
         self.content = self.matchs.group(2)
         super(Heading, self).setup()
-        self.scanner.parse(self.content, self.scanner.default_inline_regex)
-        tail = self._clone()
-        tail.is_head = False
-        self.scanner.add_token(tail)
+        self._parse_content(self.scanner.default_inline_regex, self._offset(2))
 
     def as_html(self, renderer):
         heading = 'h{lvl}'.format(lvl=self.heading_level)
@@ -224,20 +400,20 @@ class Heading(TokenBase):
 
 class LHeading(Heading):
     regex = re.compile(r'^([^\n]+)\n *(=|-)+ *(?:\n+|$)')
+    leading_chars = None
 
     def setup(self):
         self.is_head = True
         self.heading_level = 1 if self.matchs.group(2) == '=' else 2
         self.content = self.matchs.group(1)
         self.scanner.add_token(self)
-        self.scanner.parse(self.content, self.scanner.default_inline_regex)
-        tail = self._clone()
-        tail.is_head = False
-        self.scanner.add_token(tail)
+        self._parse_content(self.scanner.default_inline_regex, self._offset(1))
 
 
 class BlockQuote(TokenBase):
     regex = re.compile(r'^( *>[^\n]+(\n[^\n]+)*\n*)+')
+    leading_chars = ' >'
+    retain_match = False
     _leading_pattern = re.compile(r'^ *> ?', re.M)
     is_head = None  # leading mark
 
@@ -249,9 +425,8 @@ class BlockQuote(TokenBase):
         self.is_head = True
         super(BlockQuote, self).setup()
         washed = self._leading_pattern.sub('', self.matchs.group(0))
-        self.scanner.parse(washed)
         block_end = BlockQuote(scanner=self.scanner, is_head=False)
-        self.scanner.add_token(block_end)
+        self.scanner.parse_nested(washed, then=(block_end,))
 
     def as_html(self, renderer):
         if self.is_head:
@@ -259,12 +434,280 @@ class BlockQuote(TokenBase):
         return renderer.close_tag('blockquote', breakline=True)
 
 
+class SourceIndex(object):
+    '''
+    facts about a source being parsed that are computed once and then looked up,
+    so that finding where a block ends stays linear in the size of the source:
+    the labels of the lines, by the offset where they start, and the offsets of
+    the last matches of given patterns.
+    lines are labelled lazily, each line at most once, with the patterns of the
+    block tokens limited to that line.
+        :param source: the source text
+    '''
+    BLANK = 1
+    FENCE = 2  # ```lang, the fence may be left open
+    HEADING = 4
+    SETEXT = 8  # === or --- under a heading
+    HRULE = 16
+    LIST = 32  # list marker followed by some content
+    QUOTE = 64
+    LINKDEF = 128
+    FOOTNOTE = 256
+    HTML = 512
+
+    # labels of the lines that end a paragraph before them, see ``paragraph_end``
+    paragraph_breaks = HEADING | HRULE | LIST | QUOTE | LINKDEF | FOOTNOTE | HTML
+
+    _blank_regex = re.compile(r' *$')
+    _newlines_regex = re.compile(r'\n*')
+    _fence_regex = re.compile(r' *(`{3,}|~{3,}) *(\S+)? *\n')
+    _fence_end_regex = re.compile(r'(`{3,}|~{3,}) *$', re.M)
+    _setext_regex = re.compile(r' *(?:=|-)+ *$')
+    _list_regex = re.compile(r' *(?:[*+-]|\d+\.) ')
+    _list_marker_regex = re.compile(r'(?:[*+-]|\d+\.) ')
+    _list_hrule_regex = re.compile(r'(?:[-*_] *){3,}$')
+    _html_regex = re.compile('<' + _block_tag)
+    _bracket_regex = re.compile(r'[\[\]]')
+
+    def __init__(self, source):
+        self.source = source
+        self._labels = {}
+        self._fences = {}
+        self._fence_ends = None
+        self._last_matches = {}
+        self._matches = {}
+        self._bracket_ends = {}
+
+    def line_end(self, start):
+        '''
+        return the offset of the newline that ends the line starting at ``start``
+        '''
+        end = self.source.find('\n', start)
+        return len(self.source) if end == -1 else end
+
+    def labels(self, start):
+        '''
+        return the labels of the line starting at ``start``, or'ed together
+        '''
+        try:
+            return self._labels[start]
+        except KeyError:
+            pass
+        source = self.source
+        end = self.line_end(start)
+        labels = 0
+        if self._blank_regex.match(source, start, end):
+            labels = self.BLANK
+        else:
+            first = source[start:end].lstrip(' ')[:1]
+            if first == '#':
+                if Heading.offset_regex().match(source, start, end):
+                    labels |= self.HEADING
+            elif first == '>':
+                if BlockQuote.offset_regex().match(source, start, end):
+                    labels |= self.QUOTE
+            elif first in '`~':
+                if self._fence_regex.match(source, start, end + 1):
+                    labels |= self.FENCE
+            elif first == '[':
+                if BlockLink.offset_regex().match(source, start, end + 1):
+                    labels |= self.LINKDEF
+                if BlockFootnote.offset_regex().match(source, start, end):
+                    labels |= self.FOOTNOTE
+            elif first == '<':
+                if self._html_regex.match(source, start, end):
+                    labels |= self.HTML
+            if first in '-*_' and Hrule.offset_regex().match(source, start, end):
+                labels |= self.HRULE
+            if first in '=-' and self._setext_regex.match(source, start, end):
+                labels |= self.SETEXT
+            if first in '*+-0123456789':
+                marker = self._list_regex.match(source, start, end)
+                # the marker must be followed by some content
+                if marker and marker.end() < len(source):
+                    labels |= self.LIST
+        self._labels[start] = labels
+        return labels
+
+    def fence_may_close(self, pos):
+        '''
+        check whether a fence opened at ``pos`` is followed by a line ending with
+        its delimiter. without one, Fence can not match, which would take a scan to
+        the end of the source to find out
+        '''
+        fence = self._fence_regex.match(self.source, pos)
+        if not fence:
+            return False
+        if self._fence_ends is None:
+            self._fence_ends = {}
+        char = fence.group(1)[0]
+        try:
+            last = self._fence_ends[char]
+        except KeyError:
+            last = self._fence_ends[char] = self._last_fence_end(char)
+        return last > fence.end()
+
+    def _last_fence_end(self, char):
+        '''
+        return where the last line ending with three ``char`` or more ends, -1 if
+        none. it is looked for from the end of the source, where it usually is
+        '''
+        source = self.source
+        delimiter = char * 3
+        end = len(source)
+        while True:
+            start = source.rfind(delimiter, 0, end)
+            if start == -1:
+                return -1
+            match = self._fence_end_regex.match(source, start)
+            if match:
+                return match.end()
+            # the delimiters that overlap the one found start before it
+            end = start + 2
+
+    def fence_at(self, start):
+        '''
+        check whether a complete fenced block starts at the line ``start``
+        '''
+        try:
+            return self._fences[start]
+        except KeyError:
+            pass
+        closed = self.fence_may_close(start) and Fence.offset_regex().match(self.source, start)
+        self._fences[start] = closed = bool(closed)
+        return closed
+
+    def next_match(self, regex, pos, key=None):
+        '''
+        return the offset of the first match of ``regex`` at or after ``pos``, -1 if
+        none. with a ``key``, only the matches whose first group is the key count.
+        the matches are found once for the whole source.
+        '''
+        try:
+            starts = self._matches[regex]
+        except KeyError:
+            starts = {}
+            for match in regex.finditer(self.source):
+                group = match.group(1) if regex.groups else None
+                starts.setdefault(group, []).append(match.start())
+            self._matches[regex] = starts
+        offsets = starts.get(key, ())
+        index = bisect_left(offsets, pos)
+        return offsets[index] if index < len(offsets) else -1
+
+    def bracket_end(self, pos):
+        '''
+        return the offset of the ] that closes the [ at ``pos``, -1 if none. the
+        brackets opened in between are closed by the first ] after them, as in the
+        pattern of InlineNolink, which matches from ``pos`` only if there is one.
+        the way from a position to the ] is the same from every [ before it that
+        gets there, it is walked once.
+        '''
+        source = self.source
+        ends = self._bracket_ends
+        walked = []
+        pos += 1
+        end = -1
+        while True:
+            if pos in ends:
+                end = ends[pos]
+                break
+            walked.append(pos)
+            match = self._bracket_regex.search(source, pos)
+            if match is None:
+                break
+            if match.group() == ']':
+                end = match.start()
+                break
+            pos = source.find(']', match.end())
+            if pos == -1:
+                break
+            pos += 1
+        for pos in walked:
+            ends[pos] = end
+        return end
+
+    def last_match(self, regex):
+        '''
+        return the offset of the last match of ``regex`` in the source, -1 if none
+        '''
+        try:
+            return self._last_matches[regex]
+        except KeyError:
+            pass
+        last = -1
+        for match in regex.finditer(self.source):
+            last = match.start()
+        self._last_matches[regex] = last
+        return last
+
+    def paragraph_end(self, pos):
+        '''
+        return where the paragraph starting at ``pos`` ends, including the newlines
+        after it. it goes on until a blank line, or a line that would start another
+        block: a heading (also a setext one), rule, list, quote, link or footnote
+        definition, block html or a complete fence.
+        '''
+        source = self.source
+        end = source.find('\n', pos)
+        while end != -1:
+            start = end + 1
+            labels = self.labels(start)
+            if labels & (self.BLANK | self.paragraph_breaks):
+                break
+            if labels & self.FENCE and self.fence_at(start):
+                break
+            next_end = source.find('\n', start)
+            if next_end != -1 and self.labels(next_end + 1) & self.SETEXT:
+                break
+            end = next_end
+        if end == -1:
+            return len(source)
+        return self._newlines_regex.match(source, end).end()
+
+    def list_end(self, pos, indent, content_start):
+        '''
+        return where the list starting at ``pos`` ends, including the newlines after
+        it. it ends at a rule or a link or footnote definition, after two blank
+        lines, or after one blank line followed by a line that is neither indented
+        nor an item of the same list.
+            :param indent: the indent of the first item
+            :param content_start: the offset after the first list marker
+        '''
+        source = self.source
+        length = len(source)
+        # the first item has at least one character
+        end = source.find('\n', content_start + 1)
+        while end != -1:
+            start = self._newlines_regex.match(source, end).end()
+            if start >= length:
+                return length
+            blank_lines = start - end - 1
+            if self.labels(start) & (self.LINKDEF | self.FOOTNOTE):
+                return start
+            line_end = self.line_end(start)
+            if self._list_hrule_regex.match(source, start, line_end):
+                return start
+            if indent and source.startswith(indent, start) and \
+                    self._list_hrule_regex.match(source, start + len(indent), line_end):
+                return start
+            if blank_lines >= 2:
+                return start
+            if blank_lines == 1 and source[start] != ' ' and not (
+                    source.startswith(indent, start) and
+                    self._list_marker_regex.match(source, start + len(indent))):
+                return start
+            end = source.find('\n', start)
+        return length
+
+
 class ListItem(TokenBase):
     regex = re.compile(
         r'^(( *)(?:[*+-]|\d+\.) [^\n]*'
         r'(?:\n(?!\2(?:[*+-]|\d+\.) )[^\n]*)*)',
         flags=re.M
     )
+    retain_match = False
 
     def __init__(self, matchs=None, scanner=None, is_head=None):
         self.is_head = is_head
@@ -278,6 +721,7 @@ class ListItem(TokenBase):
 
 class ListBullet(TokenBase):
     regex = re.compile(r'^ *(?:[*+-]|\d+\.) +')
+    retain_match = False
 
 
 class ListBlock(TokenBase):
@@ -296,9 +740,13 @@ class ListBlock(TokenBase):
             BlockFootnote.pattern(),
         )
     )
+    leading_chars = ' *+-0123456789'
+    retain_match = False
     list_item_token = ListItem
     list_bullet_token = ListBullet
     is_head = None
+    _start_regex = re.compile(r'( *)([*+-]|\d+\.) ')
+    _span_regex = re.compile(r'( *)([*+-]|\d+\.) [\s\S]*')
 
     def __init__(self, matchs=None, scanner=None, is_head=None, **kwargs):
         self.is_head = is_head
@@ -310,23 +758,41 @@ class ListBlock(TokenBase):
         self.is_head = True
         self.scanner.add_token(self)
 
-        # parse list items
-        items = self.list_item_token.regex.findall(self.matchs.group(0))
-        for item, _ in items:
+        # parse list items, each one opens the next when its content is parsed
+        items = list(self.list_item_token.regex.finditer(self.matchs.group(0)))
+        self.scanner.add_token(self.list_item_token(scanner=self.scanner, is_head=True))
+        for index, item in enumerate(items):
+            offset = item.start()
+            item = item.group(1)
             space = len(item)
             item = self.list_bullet_token.regex.sub('', item)
+            offset += space - len(item)
 
             if '\n' in item:
                 space = space - len(item)
-                item = re.compile(r'^ {1,%d}' % space, flags=re.M).sub('', item)
+                item = _indent_regex(space).sub('', item)
 
-            self.scanner.add_token(
-                self.list_item_token(scanner=self.scanner, is_head=True))
-            self.scanner.parse(item, self.scanner.list_regex)
-            self.scanner.add_token(
-                self.list_item_token(scanner=self.scanner, is_head=False))
-        list_end = ListBlock(scanner=self.scanner, is_head=False, ordered=self.ordered)
-        self.scanner.add_token(list_end)
+            item_end = self.list_item_token(scanner=self.scanner, is_head=False)
+            if index + 1 < len(items):
+                then = (item_end, self.list_item_token(scanner=self.scanner, is_head=True))
+            else:
+                list_end = ListBlock(scanner=self.scanner, is_head=False, ordered=self.ordered)
+                then = (item_end, list_end)
+            self.scanner.parse_nested(item, self.scanner.list_regex, then=then, offset=offset)
+
+    @classmethod
+    def match(cls, source, scanner=None, pos=0):
+        '''
+        find the end of the list from the labels of the following lines instead of
+        ``cls.regex``, whose lazy scan tries every alternative at each character
+        '''
+        if cls.regex is not ListBlock.regex:
+            return super(ListBlock, cls).match(source, scanner, pos)
+        start = cls._start_regex.match(source, pos)
+        if not start or start.end() >= len(source):
+            return None
+        end = source_index(source, scanner).list_end(pos, start.group(1), start.end())
+        return cls(cls._span_regex.match(source, pos, end), scanner=scanner)
 
     def as_html(self, renderer):
         tag = 'ol' if self.ordered else 'ul'
@@ -351,15 +817,28 @@ class Paragraph(TokenBase):
             '<' + _block_tag,
         )
     )
+    retain_match = False
+    _span_regex = re.compile(r'([\s\S]*)')
+
+    @classmethod
+    def match(cls, source, scanner=None, pos=0):
+        '''
+        find the end of the paragraph from the labels of the following lines instead
+        of ``cls.regex``, which tries the patterns of nine other blocks after every
+        line
+        '''
+        if cls.regex is not Paragraph.regex:
+            return super(Paragraph, cls).match(source, scanner, pos)
+        if pos >= len(source) or source[pos] == '\n':
+            return None
+        end = source_index(source, scanner).paragraph_end(pos)
+        return cls(cls._span_regex.match(source, pos, end), scanner=scanner)
 
     def setup(self):
         self.is_head = True
         self.content = self.matchs.group(1).rstrip('\n')
         super(Paragraph, self).setup()
-        self.scanner.parse(self.content, self.scanner.default_inline_regex)
-        tail = self._clone()
-        tail.is_head = False
-        self.scanner.add_token(tail)
+        self._parse_content(self.scanner.default_inline_regex, self._offset(1))
 
     def as_html(self, renderer):
         if self.is_head:
@@ -367,16 +846,54 @@ class Paragraph(TokenBase):
         return renderer.close_tag('p', breakline=True)
 
 
+def _match_html(cls, source, scanner, pos):
+    '''
+    match the html pattern of BlockHtml or InlineHtml at ``pos``. the lazy content
+    of a comment or of a tag would be searched for its end until the end of the
+    source, from every < where it is missing: a comment is not tried without a
+    ``_comment_end_regex`` after it, and a tag is tried without content when it has
+    no ``_closing_tag_regex`` of its name after it.
+    '''
+    opener = cls._opener_regex.match(source, pos)
+    if opener is None:
+        return None
+    index = source_index(source, scanner)
+    tag = opener.group(1)
+    if tag == '!--':
+        if index.next_match(cls._comment_end_regex, opener.end()) == -1:
+            return None
+        regex = cls.offset_regex()
+    elif index.next_match(cls._closing_tag_regex, opener.end(), tag) == -1:
+        regex = cls._unclosed_regex
+    else:
+        regex = cls.offset_regex()
+    return regex.match(source, pos)
+
+
 class BlockHtml(TokenBase):
-    regex = re.compile(
-        r'^ *(?:%s|%s|%s) *(?:\n{2,}|\s*$)' % (
-            r'<!--[\s\S]*?-->',
-            r'<(%s)((?:%s)*?)>([\s\S]*?)<\/\1>' % (_block_tag, _valid_attr),
-            r'<%s(?:%s)*?\s*\/?>' % (_block_tag, _valid_attr),
-        )
+    _patterns = (
+        r'<!--[\s\S]*?-->',
+        r'<(%s)((?:%s)*?)>([\s\S]*?)<\/\1>' % (_block_tag, _valid_attr),
+        r'<%s(?:%s)*?\s*\/?>' % (_block_tag, _valid_attr),
     )
+    regex = re.compile(r'^ *(?:%s|%s|%s) *(?:\n{2,}|\s*$)' % _patterns)
+    leading_chars = ' <'
+    retain_match = False
     html_attrs = None
     tag = None
+    # the regex without the tag that has content, with the same groups
+    _unclosed_regex = re.compile(
+        r' *(?:%s|(?!)()()()|%s) *(?:\n{2,}|\s*$)' % (_patterns[0], _patterns[2]))
+    _opener_regex = re.compile(r' *<(!--|\w+)')
+    _comment_end_regex = re.compile(r'--> *(?:\n{2,}|\s*$)')
+    _closing_tag_regex = re.compile(r'<\/(\w+)> *(?:\n{2,}|\s*$)')
+
+    @classmethod
+    def match(cls, source, scanner=None, pos=0):
+        if cls.regex is not BlockHtml.regex:
+            return super(BlockHtml, cls).match(source, scanner, pos)
+        match = _match_html(cls, source, scanner, pos)
+        return cls(match, scanner=scanner) if match else None
 
     def setup(self):
         if not self.matchs.group(1):
@@ -402,59 +919,117 @@ class BlockHtml(TokenBase):
 
 
 class Table(TokenBase):
+    '''
+    ``header``, ``align`` and ``cells`` are split from the raw fields into lists
+    on first read, by ``parse_header``, ``parse_align`` and ``parse_cells``, and
+    ``as_html`` renders them row by row
+    '''
     regex = re.compile(
         r'^ *\|(.+)\n *\|( *[-:]+[-| :]*)\n((?: *\|.*(?:\n|$))*)\n*'
     )
+    leading_chars = ' |'
+    retain_match = False
+    _cell_split = re.compile(r' *\| *')
+    _header_strip = re.compile(r'^ *| *\| *$')
+    _align_strip = re.compile(r' *|\| *$')
+    _aligns = (
+        (re.compile(r'^ *:-+ *$'), 'left'),
+        (re.compile(r'^ *:-+: *$'), 'center'),
+        (re.compile(r'^ *-+: *$'), 'right'),
+    )
+    _rows_strip = re.compile(r'(?: *\| *)?\n$')
+    _row_strip = re.compile(r'^ *\| *| *\| *$')
+    _cell_marker = '\x00'  # the content of a cell in the templates of ``as_html``
+    _header = _align = _cells = None
+
+    def setup(self):
+        self.raw_header = self.matchs.group(1)
+        self.raw_align = self.matchs.group(2)
+        self.raw_cells = self.matchs.group(3)
+        super(Table, self).setup()
 
     @property
     def header(self):
-        return re.split(r' *\| *', re.sub(r'^ *| *\| *$', '', self.matchs.group(1)))
+        if self._header is None:
+            self._header = self.parse_header(self.raw_header)
+        return self._header
 
     @property
     def align(self):
-        align = re.split(r' *\| *', re.sub(r' *|\| *$', '', self.matchs.group(2)))
-        for index, alg in enumerate(align):
-            if re.search(r'^ *:-+ *$', alg):
-                align[index] = 'left'
-            elif re.search(r'^ *:-+: *$', alg):
-                align[index] = 'center'
-            elif re.search(r'^ *-+: *$', alg):
-                align[index] = 'right'
-            else:
-                align[index] = None
-        return align
+        if self._align is None:
+            self._align = self.parse_align(self.raw_align)
+        return self._align
 
     @property
     def cells(self):
-        cells = re.sub(r'(?: *\| *)?\n$', '', self.matchs.group(3)).split('\n')
+        if self._cells is None:
+            self._cells = self.parse_cells(self.raw_cells)
+        return self._cells
+
+    def parse_header(self, raw_header):
+        return self._cell_split.split(self._header_strip.sub('', raw_header))
+
+    def parse_align(self, raw_align):
+        align = self._cell_split.split(self._align_strip.sub('', raw_align))
+        for index, alg in enumerate(align):
+            align[index] = None
+            for regex, value in self._aligns:
+                if regex.search(alg):
+                    align[index] = value
+                    break
+        return align
+
+    def parse_cells(self, raw_cells):
+        cells = self._rows_strip.sub('', raw_cells).split('\n')
         for index, cell in enumerate(cells):
-            cell = re.sub(r'^ *\| *| *\| *$', '', cell)
-            cells[index] = re.split(r' *\| *', cell)
+            cell = self._row_strip.sub('', cell)
+            cells[index] = self._cell_split.split(cell)
         return cells
 
     def as_html(self, renderer):
         self.renderer = renderer
-        cell = header = body = renderer.placeholder
-        for index, value in enumerate(self.header):
-            align = self.align[index] if index < len(self.align) else None
-            cell += self.format_cell(value, header=True, align=align)
-        header += self.format_row(cell)
-
-        for index, row in enumerate(self.cells):
-            cell = renderer.placeholder
-            for row_index, value in enumerate(row):
-                align = self.align[row_index] if row_index < len(self.align) else None
-                cell += self.format_cell(value, header=True, align=align)
-            body += self.format_row(cell)
-
+        format_cells = self._template_formatter(renderer) or self._format_cells
+        header = renderer.placeholder + self.format_row(format_cells(self.header))
+        body = renderer.placeholder + ''.join([
+            self.format_row(format_cells(row)) for row in self.cells])
         return renderer.table(header, body)
 
+    def _format_cells(self, row):
+        align = self.align
+        return ''.join([
+            self.format_cell(value, header=True, align=align[index] if index < len(align) else None)
+            for index, value in enumerate(row)])
+
+    def _template_formatter(self, renderer):
+        '''
+        return a function that formats the cells of a row by filling in the html of
+        ``format_cell`` for each column, or None when ``format_cell`` or the
+        ``block_html`` of the renderer are overridden and may depend on the content
+        '''
+        if (type(self).format_cell is not Table.format_cell or
+                type(renderer).block_html is not Renderer.block_html):
+            return None
+        marker = self._cell_marker
+        width = max([len(self.header)] + [len(row) for row in self.cells])
+        templates = [
+            self.format_cell(marker, header=True, align=align).split(marker)
+            for align in self.align[:width]
+        ]
+        templates += [self.format_cell(marker, header=True).split(marker)] * (
+            width - len(templates))
+
+        def format_cells(row):
+            return ''.join([
+                prefix + value + suffix for (prefix, suffix), value in zip(templates, row)])
+        return format_cells
+
     def format_row(self, content):
         return self.renderer.tr(content)
 
     def format_cell(self, content, **options):
         '''
-        return a table cell
+        return a table cell. unless it is overridden, ``as_html`` calls it once per
+        column, with a marker in place of the content
         '''
         if options.get('header'):
             tag = 'th'
@@ -469,26 +1044,25 @@ class NpTable(Table):
     regex = re.compile(
         r'^ *(\S.*\|.*)\n *([-:]+ *\|[-| :]*)\n((?:.*\|.*(?:\n|$))*)\n*'
     )
+    leading_chars = None
+    _rows_strip = re.compile(r'\n$')
 
-    @property
-    def cells(self):
-        cells = re.sub(r'\n$', '', self.matchs.group(3)).split('\n')
+    def parse_cells(self, raw_cells):
+        cells = self._rows_strip.sub('', raw_cells).split('\n')
         for index, cell in enumerate(cells):
-            cells[index] = re.split(r' *\| *', cell)
+            cells[index] = self._cell_split.split(cell)
         return cells
 
 
 class BlockText(TokenBase):
     regex = re.compile(r'^[^\n]+')
+    retain_match = False
 
     def setup(self):
         self.is_head = True
         self.content = self.matchs.group(0)
         super(BlockText, self).setup()
-        self.scanner.parse(self.content, self.scanner.default_inline_regex)
-        tail = self._clone()
-        tail.is_head = False
-        self.scanner.add_token(tail)
+        self._parse_content(self.scanner.default_inline_regex, 0)
 
     def as_html(self, renderer):
         if self.is_head:
@@ -501,9 +1075,15 @@ class BlockText(TokenBase):
 
 class Escape(TokenBase):
     regex = re.compile(r'^\\([\\`*{}\[\]()#+\-.!_>~|])')  # \* \+ \! ....
+    leading_chars = '\\'
+    retain_match = False
+
+    def setup(self):
+        self.content = self.matchs.group(1)
+        super(Escape, self).setup()
 
     def as_html(self, renderer):
-        return renderer.escape(self.matchs.group(1))
+        return renderer.escape(self.content)
 
 
 class InlineHtml(TokenBase):
@@ -513,13 +1093,25 @@ class InlineHtml(TokenBase):
         'ruby', 'rt', 'rp', 'bdi', 'bdo', 'span', 'br', 'wbr', 'ins', 'del',
         'img', 'font',
     ]
-    regex = re.compile(
-        r'^(?:%s|%s|%s)' % (
-            r'<!--[\s\S]*?-->',
-            r'<(\w+%s)((?:%s)*?)\s*>([\s\S]*?)<\/\1>' % (_valid_end, _valid_attr),
-            r'<\w+%s(?:%s)*?\s*\/?>' % (_valid_end, _valid_attr),
-        )
+    _patterns = (
+        r'<!--[\s\S]*?-->',
+        r'<(\w+%s)((?:%s)*?)\s*>([\s\S]*?)<\/\1>' % (_valid_end, _valid_attr),
+        r'<\w+%s(?:%s)*?\s*\/?>' % (_valid_end, _valid_attr),
     )
+    regex = re.compile(r'^(?:%s|%s|%s)' % _patterns)
+    leading_chars = '<'
+    retain_match = False
+    _unclosed_regex = re.compile(r'(?:%s|(?!)()()()|%s)' % (_patterns[0], _patterns[2]))
+    _opener_regex = re.compile(r'<(!--|\w+)')
+    _comment_end_regex = re.compile(r'-->')
+    _closing_tag_regex = re.compile(r'<\/(\w+)>')
+
+    @classmethod
+    def match(cls, source, scanner=None, pos=0):
+        if cls.regex is not InlineHtml.regex:
+            return super(InlineHtml, cls).match(source, scanner, pos)
+        match = _match_html(cls, source, scanner, pos)
+        return cls(match, scanner=scanner) if match else None
 
     def setup(self):
         self.is_head = True
@@ -529,10 +1121,7 @@ class InlineHtml(TokenBase):
         self.extra = self.matchs.group(2) or ''
         self.content = self.matchs.group(3)
         super(InlineHtml, self).setup()
-        self.scanner.parse(self.content, self.scanner.inline_htmls)
-        tail = self._clone()
-        tail.is_head = False
-        self.scanner.add_token(tail)
+        self._parse_content(self.scanner.inline_htmls, self._offset(3))
 
     def as_html(self, renderer):
         if self.is_head:
@@ -542,10 +1131,17 @@ class InlineHtml(TokenBase):
 
 class InlineAutoLink(TokenBase):
     regex = re.compile(r'^<([^ >]+(@|:)[^ >]+)>')
+    leading_chars = '<'
+    retain_match = False
+
+    def setup(self):
+        self.link = self.matchs.group(1)
+        self.is_email = self.matchs.group(2) == '@'
+        super(InlineAutoLink, self).setup()
 
     def as_html(self, renderer):
-        link = renderer.escape(self.matchs.group(1))
-        addr = 'mailto:%s' % link if self.matchs.group(2) == '@' else ''
+        link = renderer.escape(self.link)
+        addr = 'mailto:%s' % link if self.is_email else ''
         return renderer.link(addr, link)
 
 
@@ -557,7 +1153,18 @@ class InlineLink(TokenBase):
         r'''\s*(<)?([\s\S]*?)(?(2)>)(?:\s+['"]([\s\S]*?)['"])?\s*'''
         r'\)'
     )
+    leading_chars = '!['
+    retain_match = False
     is_head = None
+    _closer_regex = re.compile(r'\)')
+
+    @classmethod
+    def match(cls, source, scanner=None, pos=0):
+        # a link that can not be closed would make the regex try every ] after pos
+        if (cls.regex is InlineLink.regex and
+                source_index(source, scanner).last_match(cls._closer_regex) < pos):
+            return None
+        return super(InlineLink, cls).match(source, scanner, pos)
 
     def setup(self):
         self.line = self.matchs.group(0)
@@ -568,10 +1175,7 @@ class InlineLink(TokenBase):
         if self.line[0] != '!':
             self.is_head = True
             self.scanner.add_token(self)
-            self.scanner.parse(self.content, self.scanner.default_inline_regex)
-            tail = self._clone()
-            tail.is_head = False
-            self.scanner.add_token(tail)
+            self._parse_content(self.scanner.default_inline_regex, self._offset(1))
         else:
             self.scanner.add_token(self)
 
@@ -591,6 +1195,17 @@ class InlineRefLink(TokenBase):
         r'(?:\[[^^\]]*\]|[^\[\]]|\](?=[^\[]*\]))*'
         r')\]\s*\[([^^\]]*)\]'
     )
+    leading_chars = '!['
+    retain_match = False
+    reads_definitions = True
+
+    @classmethod
+    def match(cls, source, scanner=None, pos=0):
+        # the text of the link goes to a ] that closes the [ as for InlineNolink, the
+        # regex would try every ] after pos otherwise
+        if cls.regex is InlineRefLink.regex and not _bracket_closed(source, scanner, pos):
+            return None
+        return super(InlineRefLink, cls).match(source, scanner, pos)
 
     def setup(self):
         self.ref_key = self._shrink_blank_characters(self.matchs.group(2) or self.matchs.group(1))
@@ -598,25 +1213,42 @@ class InlineRefLink(TokenBase):
         super(InlineRefLink, self).setup()
 
     def as_html(self, renderer):
-        links = filter(lambda x: x.ref_key == self.ref_key, self.scanner.links)
-        if not links:
+        link = self.scanner.get_link(self.ref_key)
+        if link is None:
             return ''
-        link = links[-1].link
-        return renderer.link(link, self.title)
+        return renderer.link(link.link, self.title)
 
 
 class InlineNolink(TokenBase):
     regex = re.compile(r'^!?\[((?:\[[^\]]*\]|[^\[\]])*)\]')
+    leading_chars = '!['
+    retain_match = False
+
+    @classmethod
+    def match(cls, source, scanner=None, pos=0):
+        if cls.regex is InlineNolink.regex and not _bracket_closed(source, scanner, pos):
+            return None
+        return super(InlineNolink, cls).match(source, scanner, pos)
+
+    def setup(self):
+        self.content = self.matchs.group(0)
+        super(InlineNolink, self).setup()
 
     def as_html(self, renderer):
-        return renderer.link('#', self.matchs.group(0))
+        return renderer.link('#', self.content)
 
 
 class InlineUrl(TokenBase):
     regex = re.compile(r'''^(https?:\/\/[^\s<]+[^<.,:;"')\]\s])''')
+    leading_chars = 'h'
+    retain_match = False
+
+    def setup(self):
+        self.link = self.matchs.group(1)
+        super(InlineUrl, self).setup()
 
     def as_html(self, renderer):
-        return renderer.escape(self.matchs.group(1))
+        return renderer.escape(self.link)
 
 
 class DoubleEmphasis(TokenBase):
@@ -625,9 +1257,15 @@ class DoubleEmphasis(TokenBase):
         r'|'
         r'^\*{2}([\s\S]+?)\*{2}(?!\*)'
     )
+    leading_chars = '_*'
+    retain_match = False
+
+    def setup(self):
+        self.content = self.matchs.group(2) or self.matchs.group(1)
+        super(DoubleEmphasis, self).setup()
 
     def as_html(self, renderer):
-        return renderer.double_emphasis(self.matchs.group(2) or self.matchs.group(1))
+        return renderer.double_emphasis(self.content)
 
 
 class Emphasis(TokenBase):
@@ -636,21 +1274,35 @@ class Emphasis(TokenBase):
         r'|'
         r'^\*((?:\*\*|[^\*])+?)\*(?!\*)'
     )
+    leading_chars = '_*'
+    retain_match = False
+
+    def setup(self):
+        self.content = self.matchs.group(2) or self.matchs.group(1)
+        super(Emphasis, self).setup()
 
     def as_html(self, renderer):
-        return renderer.emphasis(self.matchs.group(2) or self.matchs.group(1))
+        return renderer.emphasis(self.content)
 
 
 class Code(TokenBase):
     regex = re.compile(r'^(`+)\s*([\s\S]*?[^`])\s*\1(?!`)')
+    leading_chars = '`'
+    retain_match = False
+
+    def setup(self):
+        self.content = self.matchs.group(2)
+        super(Code, self).setup()
 
     def as_html(self, renderer):
-        content = renderer.escape(self.matchs.group(2), smart_amp=False)
+        content = renderer.escape(self.content, smart_amp=False)
         return renderer.code(content)
 
 
 class LineBreak(TokenBase):
     regex = re.compile(r'^ {2,}\n(?!\s*$)')
+    leading_chars = ' '
+    retain_match = False
 
     def as_html(self, renderer):
         return renderer.line_break
@@ -661,35 +1313,81 @@ class StrikeThrough(TokenBase):
     strikethrough like ~~text~~
     '''
     regex = re.compile(r'^~~(?=\S)([\s\S]*?\S)~~')
+    leading_chars = '~'
+    retain_match = False
+    _closer_regex = re.compile(r'(?<=\S)(?=~~)')
+
+    @classmethod
+    def match(cls, source, scanner=None, pos=0):
+        # the lazy content would otherwise be stretched to the end of the source
+        if (cls.regex is StrikeThrough.regex and
+                source_index(source, scanner).last_match(cls._closer_regex) < pos + 3):
+            return None
+        return super(StrikeThrough, cls).match(source, scanner, pos)
+
+    def setup(self):
+        self.content = self.matchs.group(1)
+        super(StrikeThrough, self).setup()
 
     def as_html(self, renderer):
-        return renderer.strikethrough(self.matchs.group(1))
+        return renderer.strikethrough(self.content)
 
 
 class InlineFootnote(TokenBase):
     regex = re.compile(r'^\[\^([^\]]+)\]')
+    leading_chars = '['
+    retain_match = False
+    reads_definitions = True
 
     def setup(self):
         self.ref_key = self._shrink_blank_characters(self.matchs.group(1))
         super(InlineFootnote, self).setup()
-        inline_footnotes = filter(
-            lambda x: isinstance(x, InlineFootnote), self.scanner.tokens)
-        self.index = inline_footnotes.index(self) + 1
+        self.index = self.scanner.count_footnote_ref()
 
     def as_html(self, renderer):
-        ref_footnote = filter(
-            lambda x: isinstance(x, BlockFootnote) and
-            x.key == self.ref_key, self.scanner.footnotes)
-        if not ref_footnote:
+        if self.scanner.get_footnote(self.ref_key) is None:
             return renderer.placeholder
         return renderer.footnote_ref(self.ref_key, self.index)
 
 
 class InlineText(TokenBase):
-    regex = re.compile(r'^[\s\S]+?(?=[\\<!\[_*`~]|https?://| {2,}\n|$)')
+    r'''
+    plain text up to the next character that may start another inline token. It
+    is the greedy form of ``^[\s\S]+?(?=[\\<!\[_*`~]|https?://| {2,}\n|$)``: runs of
+    ordinary characters are consumed by a single character class, instead of
+    testing the lookahead after every character.
+    '''
+    regex = re.compile(
+        r'^[\s\S]'
+        r'(?:[^\\<!\[_*`~h \n]+'  # ordinary characters
+        r'|h(?!ttps?://)'  # an 'h' that does not start an url
+        r'| (?! +\n)'  # a space that does not start a line break
+        r'|\n(?!\Z))*'  # a newline that is not the trailing one
+    )
+    retain_match = False
+
+    def setup(self):
+        self.content = self.matchs.group(0)
+        super(InlineText, self).setup()
+
+    def as_html(self, renderer):
+        return renderer.escape(self.content)
+
+
+class PlainText(TokenBase):
+    '''
+    the whole source as escaped text, without any markdown. the parser renders it
+    instead of the tokens when the source goes over the limits of the scanner
+    '''
+    regex = re.compile(r'^[\s\S]+')
+    retain_match = False
+
+    def setup(self):
+        self.content = self.matchs.group(0)
+        super(PlainText, self).setup()
 
     def as_html(self, renderer):
-        return renderer.escape(self.matchs.group(0))
+        return renderer.plain_text(self.content)
 
 
 blocks_default = [
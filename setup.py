@@ -14,6 +14,6 @@ setup(
     author='lAzUr',
     author_email='jonwing.lee@gmail.com',
     keywords='markdown html converter',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     include_package_data=True,
 )
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+'''
+tests of morphling, run with ``python -m pytest tests``
+'''
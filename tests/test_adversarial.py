@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+'''
+check that the time to render the inputs crafted to make the regexes backtrack
+stays linear in their size
+'''
+import pytest
+
+from benchmarks.adversarial import best_time, cases
+
+
+@pytest.mark.parametrize('name', list(cases))
+def test_linear_time(name, n=2000, repeat=3, tolerance=3.0):
+    build = cases[name]
+    small = best_time(build(n), repeat)
+    large = best_time(build(4 * n), repeat)
+    # too fast to tell apart from noise
+    assert large <= 0.01 or large <= 4 * tolerance * max(small, 1e-4), (small, large)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+'''
+check ``Renderer.escape`` against the plain implementation it replaced, on random
+strings
+'''
+import random
+
+import pytest
+
+from morphling.renderer import Renderer
+
+from benchmarks.escaping import reference_escape
+
+
+# pieces of the random strings, with entities, broken entities and quotes
+_pieces = [
+    'a', 'word ', ' ', '\n', '&', '&amp;', '&#39;', '&#x27;', '&lt', '&nbsp;', '&&', '&;',
+    '<', '>', '<b>', '"', "'", 'é', 'é;', '#', ';', '\\',
+]
+
+
+@pytest.mark.parametrize('quote', [False, True])
+@pytest.mark.parametrize('smart_amp', [False, True])
+def test_escape(quote, smart_amp):
+    renderer = Renderer()
+    generator = random.Random(0)
+    for _ in range(100000):
+        content = ''.join(generator.choice(_pieces) for _ in range(generator.randint(0, 12)))
+        expected = reference_escape(content, quote, smart_amp)
+        assert renderer.escape(content, quote, smart_amp) == expected, content
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+'''
+check that the grammars follow the token classes whose regex is set again
+'''
+import re
+
+from morphling.grammar import Alternation
+from morphling.parser import MarkdownParser
+from morphling.token import Heading, LHeading
+
+
+_percent_heading = re.compile(r'^ *(%{1,6}) *([^\n]+?) *%* *(?:\n+|$)')
+
+
+def test_reassigned_regex(monkeypatch):
+    assert MarkdownParser().render('# a') == '<h1 >a</h1>\n'
+    monkeypatch.setattr(Heading, 'regex', _percent_heading)
+    assert MarkdownParser().render('% a\n\n# b') == '<p >% a</p>\n<p ># b</p>\n'
+    monkeypatch.setattr(Heading, 'leading_chars', ' %')
+    assert MarkdownParser().render('% a\n\n# b') == '<h1 >a</h1>\n<p ># b</p>\n'
+
+
+def test_stale_alternation(monkeypatch):
+    alternation = Alternation([Heading, LHeading])
+    monkeypatch.setattr(Heading, 'regex', _percent_heading)
+    assert alternation.match('# a') is None
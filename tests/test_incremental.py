@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+'''
+check that ``MarkdownParser.reparse`` gives the same html as a full render after
+each edit of a document
+'''
+from morphling.parser import MarkdownParser
+
+from benchmarks.corpus import features, generate
+from benchmarks.incremental import edits
+
+
+def test_reparse(size=20000, count=500, seed=0):
+    parser = MarkdownParser()
+    document = parser.parse_document(generate(features, size, seed))
+    for offset, deleted, inserted in edits(document.content, count, seed):
+        parser.reparse(document, offset, deleted, inserted)
+        assert document.html == parser.render(document.content), (
+            offset, deleted, inserted, document.content)
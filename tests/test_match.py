@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+'''
+check that subclasses replacing the regex of a token class with a ``match`` of its
+own are matched with their regex
+'''
+import re
+
+import pytest
+
+from morphling.parser import MarkdownParser
+from morphling.scanner import Scanner
+from morphling.token import Fence, InlineLink, Paragraph, StrikeThrough
+
+
+class LineParagraph(Paragraph):
+    regex = re.compile(r'^([^\n]+)\n*')
+
+
+class ColonFence(Fence):
+    regex = re.compile(r'^ *(:{3,}) *(\S+)? *\n([\s\S]*?)\s*\1 *(?:\n+|$)')
+
+
+class TildeStrikeThrough(StrikeThrough):
+    regex = re.compile(r'^~(?=\S)([\s\S]*?\S)~')
+
+
+class AngleLink(InlineLink):
+    regex = re.compile(r'^\[([^\]]*)\]<()([^>]*)>()')
+
+
+@pytest.mark.parametrize('subclass, content, html', [
+    (LineParagraph, 'a\nb', '<p >a</p>\n<p >b</p>\n'),
+    (ColonFence, '::: py\nx = 1\n:::\n', '<pre><code class=lang-py>x = 1\n</code></pre>'),
+    (TildeStrikeThrough, 'a ~b~ c', '<p >a <del >b</del> c</p>\n'),
+    (AngleLink, 'a [b]<http://x> c', '<p >a <a href=http://x>b</a> c</p>\n'),
+])
+def test_replaced_regex(subclass, content, html):
+    scanner = Scanner()
+    base = subclass.__bases__[0]
+    for name in ('default_regex', 'default_inline_regex'):
+        setattr(scanner, name, [
+            subclass if token_class is base else token_class
+            for token_class in getattr(scanner, name)])
+    assert MarkdownParser(scanner=scanner).render(content) == html
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+'''
+check that the peak memory of parsing a document grows linearly with its size,
+up to a document of 1 MB: tokens that kept their match object pinned a copy of
+the source each. tokens of other classes than the built-in ones keep it.
+'''
+import gc
+import tracemalloc
+
+from morphling.parser import MarkdownParser
+from morphling.scanner import Scanner
+from morphling.token import Code
+
+from benchmarks.corpus import features, generate
+
+
+def _peak(size, seed=0):
+    '''
+    return the peak memory in bytes of parsing a generated document of ``size``
+    characters, with its tokens kept
+    '''
+    content = generate(features, size, seed)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        scanner = Scanner()
+        scanner.parse(content)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_linear_peak(size=1000000, tolerance=1.5):
+    small = _peak(size // 4)
+    large = _peak(size)
+    assert large <= 4 * tolerance * small, (small, large)
+
+
+def test_subclass_keeps_match():
+    class MyCode(Code):
+        def as_html(self, renderer):
+            return '<tt>%s</tt>' % self.matchs.group(2)
+
+    scanner = Scanner()
+    scanner.default_inline_regex = [
+        MyCode if token_class is Code else token_class
+        for token_class in scanner.default_inline_regex]
+    assert not Code.retain_match and MyCode.retain_match
+    assert MarkdownParser(scanner=scanner).render('a `b` c') == '<p >a <tt>b</tt> c</p>\n'
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+'''
+check that parsing over a pool of processes gives the same html as parsing in
+one, on documents split in small chunks
+'''
+import random
+
+from morphling import parallel
+from morphling.parser import MarkdownParser
+
+from benchmarks.corpus import features, generate, generate_pieces
+
+
+def test_parallel(count=40, seed=0):
+    generator = random.Random(seed)
+    serial = MarkdownParser()
+    documents = [generate(features, 50000, seed)]
+    documents.extend(generate_pieces(generator) for _ in range(count))
+    for content in documents:
+        scanner = serial._scanner.spawn()
+        parallel.parse(scanner, content, workers=2, min_size=generator.choice((50, 500)))
+        assert serial._render_tokens(scanner) == serial.render(content), content
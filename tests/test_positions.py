@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+'''
+check the source positions recorded with ``positions=True``: the lines and
+columns agree with the offsets, ``PositionIndex`` finds the same tokens as a
+scan of all of them, and the html does not change
+'''
+import random
+from bisect import bisect_right
+
+from morphling.parser import MarkdownParser
+from morphling.positions import line_starts
+
+from benchmarks.corpus import features, generate
+
+
+def test_positions(size=20000, count=20, seed=0):
+    # documents with tabs and other line breaks thrown in
+    generator = random.Random(seed)
+    plain = MarkdownParser()
+    parser = MarkdownParser(positions=True)
+    for index in range(count):
+        content = generate(features, size, seed + index)
+        if index % 2:
+            content = content.replace('\n', generator.choice(('\r\n', '\r', '\n\t')))
+        assert parser.render(content) == plain.render(content), content
+        starts = line_starts(content)
+        positions = parser.position_index()
+        for token in positions.tokens:
+            assert 0 <= token.start <= token.end <= len(content), token
+            line = bisect_right(starts, token.start)
+            assert (token.lineno, token.column) == (line, token.start - starts[line - 1]), token
+        for offset in range(0, len(content), 7):
+            expected = [token for token in positions.tokens if token.start <= offset < token.end]
+            found = positions.tokens_at(offset)
+            assert sorted(map(id, found)) == sorted(map(id, expected)), offset
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+'''
+check the times profiled per token class, with a ``match`` of their own or not
+'''
+from morphling.scanner import Scanner
+from morphling.stats import ScannerStats
+from morphling.token import BlockText, ListBlock, Paragraph
+
+from benchmarks.corpus import features, generate
+
+
+def test_setup_time():
+    stats = ScannerStats()
+    Scanner(stats=stats).parse(generate(features, 50000))
+    for token_class in (Paragraph, ListBlock, BlockText):
+        token_stats = stats.get(token_class)
+        assert token_stats.matches
+        assert token_stats.match_time > 0 and token_stats.setup_time > 0, token_class
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+'''
+check that rendering a document read piece by piece gives the same html as
+rendering it whole, on documents cut at random
+'''
+import io
+import random
+
+from morphling.parser import MarkdownParser
+
+from benchmarks.corpus import features, generate, generate_pieces
+
+
+def _cut(content, generator):
+    '''
+    return the content in pieces of random sizes
+    '''
+    pieces = []
+    pos = 0
+    while pos < len(content):
+        end = pos + generator.randint(1, 200)
+        pieces.append(content[pos:end])
+        pos = end
+    return pieces
+
+
+def test_stream(count=60, seed=0):
+    generator = random.Random(seed)
+    parser = MarkdownParser()
+    documents = [generate(features, 50000, seed)]
+    documents.extend(generate_pieces(generator) for _ in range(count))
+    for content in documents:
+        stream = io.StringIO()
+        parser.render_stream(_cut(content, generator), stream)
+        assert stream.getvalue() == parser.render(content), content
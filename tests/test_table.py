@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+'''
+check the hooks of Table for subclasses: the ``header``, ``align`` and ``cells``
+properties, and ``format_cell``
+'''
+from morphling.parser import MarkdownParser
+from morphling.scanner import Scanner
+from morphling.token import Table
+
+
+_table = '| a | b |\n|:-|-:|\n| c | d |\n| e | f |\n'
+
+
+def _render(table_class, content=_table):
+    scanner = Scanner()
+    scanner.default_regex = [
+        table_class if token_class is Table else token_class
+        for token_class in scanner.default_regex]
+    return MarkdownParser(scanner=scanner).render(content)
+
+
+def test_cells_property():
+    class FirstRowTable(Table):
+        @property
+        def cells(self):
+            return [self.raw_cells.split('\n')[0].strip(' |').split(' | ')]
+
+    html = _render(FirstRowTable)
+    assert '>c</th>' in html and '>e</th>' not in html
+
+
+def test_format_cell_per_cell():
+    contents = []
+
+    class UpperTable(Table):
+        def format_cell(self, content, **options):
+            contents.append(content)
+            return super(UpperTable, self).format_cell(content.upper(), **options)
+
+    assert _render(UpperTable) == MarkdownParser().render(_table.upper())
+    assert contents == ['a', 'b', 'c', 'd', 'e', 'f']
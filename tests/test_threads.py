@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+'''
+render different documents through the shared ``morphling.mdp`` from many
+threads at once and check each html against the one rendered serially
+'''
+import sys
+import threading
+
+from morphling import mdp
+
+from benchmarks.corpus import features, generate
+
+
+def test_threads(threads=16, rounds=20, size=5000):
+    documents = [generate(features, size, seed) for seed in range(threads * rounds)]
+    expected = [mdp.render(content) for content in documents]
+    errors = []
+    barrier = threading.Barrier(threads)
+
+    def render(index):
+        barrier.wait()
+        for number in range(index, len(documents), threads):
+            try:
+                html = mdp.render(documents[number])
+            except Exception as e:
+                errors.append((documents[number], repr(e)))
+                return
+            if html != expected[number]:
+                errors.append((documents[number], html))
+                return
+
+    # switch threads much more often than by default, to interleave the renders
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        workers = [threading.Thread(target=render, args=(index,)) for index in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert not errors, errors[0]